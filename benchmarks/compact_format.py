@@ -0,0 +1,92 @@
+# Compares the size and the encode/decode speed of the compact format with plain JSON
+# on a synthetic backup.
+#
+#   python benchmarks/compact_format.py [text_channels] [messages per channel] [members]
+
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from discord_backups import compact  # noqa: E402
+
+
+def synthetic_backup(text_channels=200, messages=20, members=5000, authors=100, seed=0):
+    rnd = random.Random(seed)
+    snowflake = iter(range(400000000000000000, 500000000000000000, 7919))
+    words = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(2, 9))) for _ in range(2000)]
+    users = [{
+        "id": str(next(snowflake)),
+        "name": f"user{i}",
+        "discriminator": f"{rnd.randint(1, 9999):04d}",
+        "avatar_url": f"https://cdn.discordapp.com/avatars/{i}/{rnd.getrandbits(64):016x}.webp?size=1024"
+    } for i in range(authors)]
+    roles = [{
+        "id": str(next(snowflake)), "default": i == 0, "name": f"role{i}", "permissions": rnd.getrandbits(31),
+        "color": rnd.getrandbits(24), "hoist": False, "position": i, "mentionable": False
+    } for i in range(50)]
+    categories = [{
+        "name": f"category{i}", "position": i, "category": None, "id": str(next(snowflake)),
+        "overwrites": {roles[0]["id"]: {"read_messages": False}}
+    } for i in range(10)]
+
+    def message():
+        author = users[min(int(rnd.expovariate(0.1)), authors - 1)]
+        return {
+            "id": str(next(snowflake)), "content": " ".join(rnd.choices(words, k=rnd.randint(1, 30))),
+            "author": dict(author), "pinned": False, "attachments": [], "embeds": [], "reactions": []
+        }
+
+    return {
+        "id": str(next(snowflake)), "name": "benchmark", "icon_url": "", "owner": users[0]["id"],
+        "member_count": members, "region": "europe", "system_channel": "general", "afk_timeout": 300,
+        "afk_channel": None, "mfa_level": 0, "verification_level": "low",
+        "explicit_content_filter": "disabled", "large": True,
+        "text_channels": [{
+            "name": f"text{i}", "position": i, "category": categories[i % 10]["id"], "id": str(next(snowflake)),
+            "overwrites": {roles[i % 50]["id"]: {"send_messages": True}}, "topic": None, "slowmode_delay": 0,
+            "nsfw": False, "messages": [message() for _ in range(messages)], "webhooks": []
+        } for i in range(text_channels)],
+        "voice_channels": [],
+        "categories": categories,
+        "roles": roles,
+        "members": [{
+            "id": str(next(snowflake)), "name": f"member{i}", "discriminator": "0001", "nick": None,
+            "roles": [role["id"] for role in rnd.sample(roles[1:], 3)]
+        } for i in range(members)],
+        "bans": [{"user": str(next(snowflake)), "reason": None} for _ in range(members // 10)],
+    }
+
+
+def measure(name, encode, decode, data, runs=5):
+    raw = encode(data)
+    start = time.perf_counter()
+    for _ in range(runs):
+        encode(data)
+    encode_time = (time.perf_counter() - start) / runs
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        decoded = decode(raw)
+    decode_time = (time.perf_counter() - start) / runs
+
+    assert decoded == data
+    print(f"{name:<12} {len(raw) / 1024:>10.1f} KiB {encode_time * 1000:>10.1f} ms {decode_time * 1000:>10.1f} ms")
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:4]]
+    data = synthetic_backup(*args)
+    print(f"{'format':<12} {'size':>14} {'encode':>13} {'decode':>13}")
+    measure("json", lambda d: json.dumps(d).encode("utf-8"), json.loads, data)
+    measure("json+gzip", lambda d: gzip.compress(json.dumps(d).encode("utf-8")),
+            lambda r: json.loads(gzip.decompress(r)), data)
+    measure("compact", compact.encode, compact.decode, data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+# In-process stand-ins for the discord.py objects used by discord_backups.
+#
+# Every API call goes through FakeHTTP, which counts it, waits `latency` seconds and simulates
+# Discord's per-route rate limits: a route bucket allows `bucket_size` calls per `bucket_window`
+# seconds, further calls get a simulated 429 and wait until the bucket resets (like discord.py does).
+
+import asyncio
+import collections
+import itertools
+import logging
+import random
+import time
+
+import discord
+
+# Simulated 429s are logged like discord.py does, so Observer.attach() sees them
+log = logging.getLogger("discord.http")
+
+
+class FakeHTTP:
+    def __init__(self, latency=0.05, bucket_size=5, bucket_window=1.0):
+        self._ids = itertools.count(600000000000000000, 4194305)
+        self.guilds = {}
+        self.reset(latency, bucket_size, bucket_window)
+
+    def reset(self, latency=0.05, bucket_size=5, bucket_window=1.0):
+        # Changes the simulated conditions and clears the counters
+        self.latency = latency
+        self.bucket_size = bucket_size
+        self.bucket_window = bucket_window
+        self.calls = collections.Counter()
+        self.rate_limited = 0
+        self.rate_limit_wait = 0
+        self._buckets = collections.defaultdict(collections.deque)
+
+    def snowflake(self):
+        return next(self._ids)
+
+    async def call(self, route, major=None):
+        # major is the id the bucket depends on (guild, channel or webhook id), like Discord's major parameters
+        self.calls[route] += 1
+        bucket = self._buckets[(route, major)]
+        while self.bucket_size:
+            now = time.perf_counter()
+            while len(bucket) != 0 and now - bucket[0] >= self.bucket_window:
+                bucket.popleft()
+
+            if len(bucket) < self.bucket_size:
+                break
+
+            wait = self.bucket_window - (now - bucket[0])
+            log.warning('We are being rate limited. Retrying in %.2f seconds. Handled under the bucket "%s"',
+                        wait, f"{route}:{major}")
+            self.rate_limited += 1
+            self.rate_limit_wait += wait
+            await asyncio.sleep(wait)
+
+        bucket.append(time.perf_counter())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    # Endpoints used through bot.http / guild._state.http
+
+    async def request(self, route, *, params=None, **kwargs):
+        # Raw discord.http.Route requests, only the paged ban list is supported
+        if (route.method, route.path) != ("GET", "/guilds/{guild_id}/bans"):
+            raise NotImplementedError(f"{route.method} {route.path}")
+
+        await self.call("GET /guilds/bans", route.guild_id)
+        params = params or {}
+        after = int(params.get("after", 0))
+        bans = sorted(self.guilds[route.guild_id]._bans.values(), key=lambda ban: ban[0].id)
+        page = [(user, reason) for user, reason in bans if user.id > after][:params.get("limit", 1000)]
+        return [
+            {"user": {"id": str(user.id), "username": getattr(user, "name", "banned"),
+                      "discriminator": getattr(user, "discriminator", "0000")}, "reason": reason}
+            for user, reason in page
+        ]
+
+    async def move_role_position(self, guild_id, positions, *, reason=None):
+        await self.call("PATCH /guilds/roles", guild_id)
+        guild = self.guilds[guild_id]
+        for entry in positions:
+            guild._roles[int(entry["id"])].position = entry["position"]
+
+    async def bulk_channel_update(self, guild_id, data, *, reason=None):
+        await self.call("PATCH /guilds/channels", guild_id)
+        guild = self.guilds[guild_id]
+        for entry in data:
+            guild._channels[int(entry["id"])].position = entry["position"]
+
+
+class FakeState:
+    def __init__(self, http):
+        self.http = http
+
+
+class FakeBot:
+    def __init__(self, http):
+        self.http = http
+
+    async def request_offline_members(self, *guilds):
+        pass
+
+
+class FakeUser:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.discriminator = f"{id % 10000:04d}"
+        self.avatar_url = f"https://cdn.discordapp.com/avatars/{id}/{id:x}.webp?size=1024"
+
+    def __str__(self):
+        return f"{self.name}#{self.discriminator}"
+
+
+class FakeAttachment:
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeMessage:
+    def __init__(self, id, author, content, attachments=()):
+        self.id = id
+        self.author = author
+        self.system_content = content
+        self.pinned = False
+        self.attachments = [FakeAttachment(url) for url in attachments]
+        self.embeds = []
+        self.reactions = []
+
+
+class FakeHistory:
+    def __init__(self, channel, messages):
+        self.channel = channel
+        self.messages = messages
+
+    async def flatten(self):
+        await self.channel.guild.http.call("GET /channels/messages", self.channel.id)
+        return self.messages
+
+    async def __aiter__(self):
+        for message in await self.flatten():
+            yield message
+
+
+class FakeWebhook:
+    def __init__(self, channel, name):
+        self.channel = channel
+        self.id = channel.guild.http.snowflake()
+        self.name = name
+        self.avatar_url = ""
+        self.url = f"https://discordapp.com/api/webhooks/{self.id}/token"
+
+    async def send(self, content=None, *, username=None, avatar_url=None, embeds=None, **kwargs):
+        await self.channel.guild.http.call("POST /webhooks", self.id)
+        self.channel.posted.append(content)
+
+    async def delete(self):
+        await self.channel.guild.http.call("DELETE /webhooks", self.id)
+
+
+class FakeRole(discord.Role):
+    # Shadow the slots and properties of discord.Role with plain attributes
+    id = name = permissions = color = colour = position = managed = mentionable = hoist = guild = None
+
+    def __init__(self, guild, id, name, position, permissions=0, color=0, default=False, managed=False):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.position = position
+        self.permissions = discord.Permissions(permissions)
+        self.color = self.colour = discord.Color(color)
+        self.hoist = False
+        self.mentionable = False
+        self.managed = managed
+        self._default = default
+
+    def is_default(self):
+        return self._default
+
+    def __lt__(self, other):
+        return (self.position, self.id) < (other.position, other.id)
+
+    def __repr__(self):
+        return f"<FakeRole {self.name!r}>"
+
+    async def edit(self, *, reason=None, **fields):
+        await self.guild.http.call("PATCH /guilds/roles/{id}", self.guild.id)
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    async def delete(self, *, reason=None):
+        await self.guild.http.call("DELETE /guilds/roles/{id}", self.guild.id)
+        self.guild._roles.pop(self.id, None)
+
+
+class FakeMember(discord.Member):
+    # Shadow the slots and properties of discord.Member with plain attributes
+    id = name = discriminator = nick = roles = guild = avatar_url = None
+
+    def __init__(self, guild, user, roles, nick=None):
+        self.guild = guild
+        self.id = user.id
+        self.name = user.name
+        self.discriminator = user.discriminator
+        self.avatar_url = user.avatar_url
+        self.nick = nick
+        self.roles = roles
+
+    def __repr__(self):
+        return f"<FakeMember {self.name!r}>"
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def edit(self, *, reason=None, roles=None, nick=None, **fields):
+        await self.guild.http.call("PATCH /guilds/members/{id}", self.guild.id)
+        if roles is not None:
+            self.roles = [self.guild.get_role(role.id) or role for role in roles]
+
+        self.nick = nick
+
+    async def add_roles(self, *roles, reason=None, atomic=True):
+        for role in roles:
+            await self.guild.http.call("PUT /guilds/members/roles", self.guild.id)
+            self.roles.append(self.guild.get_role(role.id) or role)
+
+
+class FakeChannel:
+    # Arguments of edit that reach the API in discord.py 1.2, everything else is dropped silently like it does
+    EDITABLE = {"name", "topic", "nsfw", "slowmode_delay", "bitrate", "user_limit", "position", "category",
+                "permission_overwrites"}
+
+    def __init__(self, guild, id, name, kind, position, category=None, overwrites=None, **attributes):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.kind = kind
+        self.position = position
+        self.category = category
+        self.overwrites = overwrites or {}
+        self.topic = attributes.get("topic")
+        self.nsfw = attributes.get("nsfw", False)
+        self.slowmode_delay = attributes.get("slowmode_delay", 0)
+        self.bitrate = attributes.get("bitrate", 64000)
+        self.user_limit = attributes.get("user_limit", 0)
+        self.messages = []
+        self.posted = []
+
+    def __repr__(self):
+        return f"<FakeChannel {self.kind} {self.name!r}>"
+
+    def is_nsfw(self):
+        return self.nsfw
+
+    def history(self, *, limit=100, before=None, after=None, around=None, oldest_first=None):
+        # self.messages is stored oldest first, like the channel itself
+        messages = self.messages
+        if after is not None:
+            messages = [message for message in messages if message.id > after.id]
+            newest_first = oldest_first is False
+        else:
+            newest_first = not oldest_first
+
+        if newest_first:
+            messages = list(reversed(messages))[:limit]
+        else:
+            messages = messages[:limit]
+
+        return FakeHistory(self, messages)
+
+    async def webhooks(self):
+        await self.guild.http.call("GET /channels/webhooks", self.id)
+        return []
+
+    async def create_webhook(self, *, name, avatar=None, reason=None):
+        await self.guild.http.call("POST /channels/webhooks", self.id)
+        return FakeWebhook(self, name)
+
+    async def edit(self, *, reason=None, **fields):
+        await self.guild.http.call("PATCH /channels/{id}", self.id)
+        for key, value in fields.items():
+            if key not in self.EDITABLE:
+                continue
+
+            if key == "category":
+                value = None if value is None else self.guild.get_channel(value.id)
+
+            elif key == "permission_overwrites":
+                key, value = "overwrites", {
+                    (self.guild.get_role if entry["type"] == "role" else self.guild.get_member)(entry["id"]):
+                        discord.PermissionOverwrite.from_pair(discord.Permissions(entry["allow"]),
+                                                              discord.Permissions(entry["deny"]))
+                    for entry in value
+                }
+
+            setattr(self, key, value)
+
+    async def delete(self, *, reason=None):
+        await self.guild.http.call("DELETE /channels/{id}", self.id)
+        self.guild._channels.pop(self.id, None)
+
+
+class FakeGuild:
+    def __init__(self, http, name="benchmark"):
+        self.http = http
+        self._state = FakeState(http)
+        self.id = http.snowflake()
+        http.guilds[self.id] = self
+        self.name = name
+        self.icon_url = ""
+        self.owner_id = http.snowflake()
+        self.region = "eu-central"
+        self.afk_timeout = 300
+        self.afk_channel = None
+        self.system_channel = None
+        self.mfa_level = 0
+        self.verification_level = "low"
+        self.explicit_content_filter = "disabled"
+        self.chunked = True
+        self.unavailable = False
+        self._roles = {}
+        self._channels = {}
+        self._members = {}
+        self._bans = {}
+        self.default_role = FakeRole(self, self.id, "@everyone", 0, permissions=104324673, default=True)
+        self._roles[self.id] = self.default_role
+
+    @property
+    def member_count(self):
+        return len(self._members)
+
+    @property
+    def large(self):
+        return len(self._members) > 250
+
+    @property
+    def roles(self):
+        return sorted(self._roles.values())
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def channels(self):
+        return list(self._channels.values())
+
+    def _channels_of(self, kind):
+        return sorted((c for c in self._channels.values() if c.kind == kind), key=lambda c: (c.position, c.id))
+
+    @property
+    def categories(self):
+        return self._channels_of("category")
+
+    @property
+    def text_channels(self):
+        return self._channels_of("text")
+
+    @property
+    def voice_channels(self):
+        return self._channels_of("voice")
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    async def edit(self, *, reason=None, **fields):
+        await self.http.call("PATCH /guilds/{id}", self.id)
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    async def create_role(self, *, reason=None, name="new role", permissions=None, color=None, colour=None,
+                          hoist=False, mentionable=False):
+        await self.http.call("POST /guilds/roles", self.id)
+        # New roles are created right above @everyone
+        for role in self._roles.values():
+            if not role.is_default():
+                role.position += 1
+
+        role = FakeRole(self, self.http.snowflake(), name, 1,
+                        permissions=0 if permissions is None else permissions.value,
+                        color=getattr(color or colour, "value", 0))
+        role.hoist = hoist
+        role.mentionable = mentionable
+        self._roles[role.id] = role
+        return role
+
+    async def _create_channel(self, kind, name, overwrites=None, category=None, reason=None, **options):
+        await self.http.call("POST /guilds/channels", self.id)
+        category = None if category is None else self.get_channel(category.id)
+        options.setdefault("position", len(self._channels))
+        channel = FakeChannel(self, self.http.snowflake(), name, kind, category=category, overwrites=overwrites,
+                              **options)
+        self._channels[channel.id] = channel
+        return channel
+
+    async def create_category(self, name, *, overwrites=None, reason=None, **options):
+        return await self._create_channel("category", name, overwrites, None, reason, **options)
+
+    create_category_channel = create_category
+
+    async def create_text_channel(self, name, *, overwrites=None, category=None, reason=None, **options):
+        return await self._create_channel("text", name, overwrites, category, reason, **options)
+
+    async def create_voice_channel(self, name, *, overwrites=None, category=None, reason=None, **options):
+        return await self._create_channel("voice", name, overwrites, category, reason, **options)
+
+    async def bans(self):
+        await self.http.call("GET /guilds/bans", self.id)
+        return [discord.guild.BanEntry(user=user, reason=reason) for user, reason in self._bans.values()]
+
+    async def ban(self, user, *, reason=None, delete_message_days=1):
+        await self.http.call("PUT /guilds/bans", self.id)
+        self._bans[user.id] = (user, reason)
+
+
+def make_guild(http, text_channels=20, voice_channels=5, categories=5, roles=20, members=500,
+               messages=20, bans=50, seed=0):
+    # A synthetic guild with the given number of entities and `messages` messages per text channel
+    rnd = random.Random(seed)
+    guild = FakeGuild(http)
+    for position in range(1, roles + 1):
+        role = FakeRole(guild, http.snowflake(), f"role-{position}", position,
+                        permissions=rnd.getrandbits(31), color=rnd.getrandbits(24))
+        guild._roles[role.id] = role
+
+    role_list = guild.roles
+    users = [FakeUser(http.snowflake(), f"user{i}") for i in range(members)]
+    for user in users:
+        member_roles = [guild.default_role] + rnd.sample(role_list[1:], min(len(role_list) - 1, rnd.randint(0, 3)))
+        guild._members[user.id] = FakeMember(guild, user, sorted(member_roles),
+                                             nick=f"nick{user.id}" if rnd.random() < 0.1 else None)
+
+    category_list = []
+    for position in range(categories):
+        category = FakeChannel(guild, http.snowflake(), f"category-{position}", "category", position,
+                               overwrites={guild.default_role: discord.PermissionOverwrite(read_messages=False)})
+        guild._channels[category.id] = category
+        category_list.append(category)
+
+    authors = users[:50] or [FakeUser(http.snowflake(), "author")]
+    for position in range(text_channels):
+        channel = FakeChannel(guild, http.snowflake(), f"text-{position}", "text", position,
+                              category=rnd.choice(category_list) if category_list else None,
+                              topic=f"topic {position}")
+        for _ in range(messages):
+            channel.messages.append(FakeMessage(http.snowflake(), rnd.choice(authors),
+                                                " ".join("word" for _ in range(rnd.randint(1, 40)))))
+
+        guild._channels[channel.id] = channel
+
+    for position in range(voice_channels):
+        channel = FakeChannel(guild, http.snowflake(), f"voice-{position}", "voice", position,
+                              category=rnd.choice(category_list) if category_list else None)
+        guild._channels[channel.id] = channel
+
+    for _ in range(bans):
+        user = FakeUser(http.snowflake(), "banned")
+        guild._bans[user.id] = (user, "spam")
+
+    return guild
+
+
+def make_target(http, members_of=None):
+    # An empty guild to load or copy into; shares the members of `members_of` so member restores have work to do
+    guild = FakeGuild(http, name="target")
+    if members_of is not None:
+        for member in members_of.members:
+            guild._members[member.id] = FakeMember(guild, member, [guild.default_role])
+
+    return guild
@@ -0,0 +1,119 @@
+# Offline benchmarks for BackupSaver.save, BackupLoader.load and copy_guild against the fakes in fakes.py.
+#
+#   python benchmarks/run.py --sizes small,medium --latency 0.05 --concurrency 1,8
+#
+# For every size, operation and concurrency it reports the wall time, the number of API calls,
+# the simulated 429s with the time spent waiting for them and the peak memory allocated by Python.
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from discord_backups import BackupLoader, BackupSaver, MetricsRecorder, copy_guild  # noqa: E402
+
+import fakes  # noqa: E402
+
+SIZES = {
+    "small": dict(text_channels=10, voice_channels=3, categories=3, roles=10, members=100, messages=10, bans=10),
+    "medium": dict(text_channels=100, voice_channels=20, categories=15, roles=50, members=2000, messages=20,
+                   bans=200),
+    "large": dict(text_channels=400, voice_channels=60, categories=40, roles=200, members=20000, messages=20,
+                  bans=2000),
+}
+
+LOAD_OPTIONS = dict(roles=True, channels=True, settings=True, members=True, bans=True)
+
+
+async def bench_save(http, size, args, concurrency, observer):
+    guild = fakes.make_guild(http, **SIZES[size])
+    return lambda: BackupSaver(fakes.FakeBot(http), None, guild, observer).save(args.chatlog, concurrency)
+
+
+async def bench_load(http, size, args, concurrency, observer):
+    origin = fakes.make_guild(http, **SIZES[size])
+    bot = fakes.FakeBot(http)
+    # Saved with an unlimited HTTP stand-in, only the load is measured
+    data = await BackupSaver(bot, None, origin).save(args.chatlog, 16)
+    target = fakes.make_target(http, members_of=origin)
+    loader = BackupLoader(bot, None, data, observer)
+    return lambda: loader.load(target, "benchmark", args.chatlog, concurrency, **LOAD_OPTIONS)
+
+
+async def bench_copy(http, size, args, concurrency, observer):
+    origin = fakes.make_guild(http, **SIZES[size])
+    target = fakes.make_target(http, members_of=origin)
+    return lambda: copy_guild(origin, target, args.chatlog, concurrency, observer)
+
+
+OPERATIONS = {"save": bench_save, "load": bench_load, "copy": bench_copy}
+
+
+async def run(operation, size, args, concurrency):
+    http = fakes.FakeHTTP(latency=0, bucket_size=0)
+    recorder = MetricsRecorder()
+    job = await OPERATIONS[operation](http, size, args, concurrency, recorder)
+
+    # Switch the fakes over to the simulated latency and rate limits for the measured part
+    http.reset(args.latency, args.bucket_size, args.bucket_window)
+    if args.memory:
+        tracemalloc.start()
+
+    handler = recorder.attach()
+    start = time.perf_counter()
+    try:
+        await job()
+    finally:
+        recorder.detach(handler)
+
+    duration = time.perf_counter() - start
+    peak = 0
+    if args.memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    failures = len(recorder.errors)
+    print(f"{operation:<6} {size:<8} {concurrency:>4} {duration:>9.2f}s {sum(http.calls.values()):>8} "
+          f"{http.rate_limited:>7} {http.rate_limit_wait:>9.2f}s {peak / 1024 / 1024:>9.1f} MiB "
+          f"{failures:>5}")
+    if args.verbose:
+        for route, count in http.calls.most_common():
+            print(f"    {count:>8}  {route}")
+
+        for phase, phase_duration in recorder.phases.items():
+            print(f"    {phase_duration:>8.2f}s {phase}")
+
+        for error in recorder.errors:
+            print(f"    error {error['entity']}: {error['type']} {error['message']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="small,medium")
+    parser.add_argument("--operations", default="save,load,copy")
+    parser.add_argument("--concurrency", default="1,8")
+    parser.add_argument("--chatlog", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per simulated API call")
+    parser.add_argument("--bucket-size", type=int, default=5, help="calls per rate limit bucket, 0 disables them")
+    parser.add_argument("--bucket-window", type=float, default=1.0, help="seconds until a bucket resets")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="don't trace peak memory")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the calls per route")
+    args = parser.parse_args()
+    # The simulated rate limit warnings are only meant for the metrics recorder
+    logging.getLogger("discord.http").propagate = False
+
+    print(f"{'op':<6} {'size':<8} {'conc':>4} {'wall':>10} {'calls':>8} {'429s':>7} {'429 wait':>10} "
+          f"{'peak mem':>13} {'errors':>5}")
+    for size in args.sizes.split(","):
+        for operation in args.operations.split(","):
+            for concurrency in args.concurrency.split(","):
+                await run(operation, size, args, int(concurrency))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,2 +1,11 @@
 from .backups import *
 from .copy import *
+from .container import *
+from .reconcile import *
+from .replay import *
+from .metrics import *
+from .checkpoint import *
+from .archive import *
+from .batch import *
+from .catalog import *
+from .snapshot import *
@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import os
+import sys
+import uuid
+
+from .metrics import Observer
+
+# Discord's upload limit for guilds without boosts
+MAX_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+__all__ = ("AttachmentArchiver", "ArchiveStats", "BlobStore", "DirectoryStore")
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    # Content addressed storage for archived files, keys are the sha256 hex digests of the content.
+    # Implement these for other backends (e.g. an object storage bucket).
+
+    async def has(self, key):
+        raise NotImplementedError
+
+    async def put(self, key, data):
+        raise NotImplementedError
+
+    async def get(self, key):
+        raise NotImplementedError
+
+
+class DirectoryStore(BlobStore):
+    # Blobs are stored as directory/ab/abcdef...
+    # The files are read and written in the default executor, so downloads continue while blobs are written.
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per write, two downloads with the same content can be stored at the same time
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+
+        os.replace(tmp, path)
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    async def has(self, key):
+        return await self._run(os.path.exists, self.path(key))
+
+    async def put(self, key, data):
+        await self._run(self._write, self.path(key), data)
+
+    async def get(self, key):
+        return await self._run(self._read, self.path(key))
+
+
+class ArchiveStats:
+    def __init__(self):
+        self.downloaded = 0
+        # Downloads whose content was already in the store
+        self.duplicates = 0
+        # Urls that were archived before and weren't downloaded again
+        self.reused = 0
+        self.too_large = 0
+        # Files that were skipped because max_total was reached
+        self.over_total = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def __repr__(self):
+        return (f"<ArchiveStats downloaded={self.downloaded} duplicates={self.duplicates} reused={self.reused} "
+                f"too_large={self.too_large} over_total={self.over_total} failed={self.failed} "
+                f"bytes={self.bytes}>")
+
+
+class AttachmentArchiver:
+    # Downloads message attachments and author avatars into a BlobStore, so a backup doesn't depend on
+    # CDN links that expire. Every url is downloaded once, files larger than max_size are skipped and
+    # max_total limits the bytes downloaded by this archiver (None for no limit). Running downloads reserve
+    # the bytes they may still take, so the limit holds with concurrent downloads too.
+    # Pass it to BackupSaver, archived messages get an "archived" dict of url -> key in the store.
+    # With session=None the aiohttp session of the BackupSaver is used.
+
+    def __init__(self, session, store, concurrency=4, max_size=MAX_SIZE, max_total=None, observer=None):
+        self.session = session
+        self.store = store
+        self.max_size = max_size
+        self.max_total = max_total
+        self.observer = observer or Observer()
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self.stats = ArchiveStats()
+        # Url -> key of the archived content (None if it couldn't be archived)
+        self.known = {}
+        self._pending = {}
+        # Bytes reserved by the running downloads, see _archive
+        self._reserved = 0
+        self._released = asyncio.Condition()
+
+    def remember(self, messages):
+        # Makes urls archived by an earlier backup known, so incremental backups don't download them again
+        for message in messages:
+            self.known.update(message.get("archived", {}))
+
+    async def _download(self, url, limit):
+        # Returns None if the file is larger than limit
+        self.observer.api_call("attachment", "download")
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            if response.content_length is not None and response.content_length > limit:
+                return None
+
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                data.extend(chunk)
+                if len(data) > limit:
+                    return None
+
+            return bytes(data)
+
+    async def _archive(self, url):
+        async with self.semaphore:
+            limit = self.max_size
+            if self.max_total is not None:
+                async with self._released:
+                    # Close to max_total, the running downloads have to finish before it's known what is left
+                    while self._reserved != 0 and self.max_total - self.stats.bytes - self._reserved < limit:
+                        await self._released.wait()
+
+                    limit = min(limit, self.max_total - self.stats.bytes - self._reserved)
+                    if limit <= 0:
+                        self.stats.over_total += 1
+                        return None
+
+            self._reserved += limit
+            try:
+                data = await self._download(url, limit)
+                if data is None:
+                    # Only limited by max_total if the reservation is smaller than max_size
+                    if limit < self.max_size:
+                        self.stats.over_total += 1
+                    else:
+                        self.stats.too_large += 1
+
+                    return None
+
+                # hashlib releases the GIL for large inputs
+                key = await asyncio.get_event_loop().run_in_executor(None, _digest, data)
+                if await self.store.has(key):
+                    self.stats.duplicates += 1
+                else:
+                    await self.store.put(key, data)
+
+                self.stats.downloaded += 1
+                self.stats.bytes += len(data)
+                return key
+            except:
+                self.stats.failed += 1
+                self.observer.error("attachment", sys.exc_info())
+                return None
+            finally:
+                self._reserved -= limit
+                if self.max_total is not None:
+                    async with self._released:
+                        self._released.notify_all()
+
+    async def archive(self, url):
+        # Returns the key of the archived content or None
+        if url in self.known:
+            if self.known[url] is not None:
+                self.stats.reused += 1
+
+            return self.known[url]
+
+        # Concurrent requests for the same url share one download
+        task = self._pending.get(url)
+        if task is None:
+            task = self._pending[url] = asyncio.ensure_future(self._archive(url))
+
+        try:
+            key = await asyncio.shield(task)
+        finally:
+            self._pending.pop(url, None)
+
+        self.known[url] = key
+        return key
+
+    async def archive_messages(self, messages):
+        # Archives the attachments and avatars of messages (as returned by utils.message_to_json)
+        urls = {
+            url
+            for message in messages
+            for url in message["attachments"] + [message["author"]["avatar_url"]]
+            if url and "archived" not in message
+        }
+        # The downloads themselves are limited by the semaphore
+        keys = dict(zip(urls, await asyncio.gather(*[self.archive(url) for url in urls])))
+        for message in messages:
+            archived = {
+                url: keys[url]
+                for url in message["attachments"] + [message["author"]["avatar_url"]]
+                if keys.get(url) is not None
+            }
+            if len(archived) != 0:
+                message["archived"] = archived
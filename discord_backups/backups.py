@@ -1,137 +1,193 @@
+import asyncio
 import discord
-import traceback
+import heapq
+import inspect
+import json
+import sys
+import time
 
-from . import utils
+from . import delta, utils
+from .catalog import Summary
+from .metrics import Observer
+from .replay import ChatlogReplayer
+from .snapshot import capture
+
+
+SECTIONS = ("text_channels", "voice_channels", "categories", "roles", "members", "bans")
 
 
 class BackupSaver():
-    def __init__(self, bot, session, guild):
+    def __init__(self, bot, session, guild, observer=None, archiver=None):
         self.session = session
         self.bot = bot
         self.guild = guild
+        self.observer = observer or Observer()
+        # Optional AttachmentArchiver for the attachments and avatars of the saved messages
+        self.archiver = archiver
+        # Optional semaphore limiting the channels fetched at once across several savers, see BackupBatch
+        self.semaphore = None
+        # Optional SnapshotCache, the roles and channels of the guild are read from a cached snapshot
+        self.snapshots = None
+        self.snapshot = None
         self.data = {}
+        # Channel id -> id of the last message that is already stored, see save_delta
+        self.after = {}
+        # Summary of the last saved backup, for BackupCatalog.add
+        self.summary = Summary()
 
-    def _overwrites_to_json(self, overwrites):
+    def _error(self, entity):
+        self.observer.error(entity, sys.exc_info())
+
+    async def _save_text_channel(self, tchannel):
         try:
-            return {str(target.id): overwrite._values for target, overwrite in overwrites.items()}
+            channel = self.guild.get_channel(tchannel.id)
+            after = self.after.get(tchannel.key)
+            if after is None:
+                history = channel.history(limit=self.chatlog)
+            else:
+                history = channel.history(limit=self.chatlog, after=discord.Object(int(after)), oldest_first=False)
+
+            async with self._fetching:
+                self.observer.api_call("text_channel", "history")
+                self.observer.api_call("text_channel", "webhooks")
+                messages, webhooks = await asyncio.gather(
+                    history.flatten(),
+                    channel.webhooks()
+                )
+            messages = [utils.message_to_json(message) for message in reversed(messages)]
+            if self.archiver is not None:
+                await self.archiver.archive_messages(messages)
+
+            return {
+                "name": tchannel.name,
+                "position": tchannel.position,
+                "category": tchannel.category_key,
+                "id": tchannel.key,
+                "overwrites": tchannel.overwrites_json(),
+                "topic": tchannel.topic,
+                "slowmode_delay": tchannel.slowmode_delay,
+                "nsfw": tchannel.nsfw,
+                "messages": messages,
+
+                "webhooks": [{
+                    "channel": str(webhook.channel.id),
+                    "name": webhook.name,
+                    "avatar": str(webhook.avatar_url),
+                    "url": webhook.url
+
+                } for webhook in webhooks]
+            }
         except:
-            return {}
+            self._error("text_channel")
 
-    async def _save_channels(self):
-        for category in self.guild.categories:
+    async def _save_categories(self):
+        for category in self.snapshot.categories:
             try:
-                self.data["categories"].append({
+                yield {
                     "name": category.name,
                     "position": category.position,
-                    "category": None if category.category is None else str(category.category.id),
-                    "id": str(category.id),
-                    "overwrites": self._overwrites_to_json(category.overwrites)
-                })
+                    "category": category.category_key,
+                    "id": category.key,
+                    "overwrites": category.overwrites_json()
+                }
             except:
-                traceback.print_exc()
+                self._error("category")
 
-        for tchannel in self.guild.text_channels:
-            try:
-                self.data["text_channels"].append({
-                    "name": tchannel.name,
-                    "position": tchannel.position,
-                    "category": None if tchannel.category is None else str(tchannel.category.id),
-                    "id": str(tchannel.id),
-                    "overwrites": self._overwrites_to_json(tchannel.overwrites),
-                    "topic": tchannel.topic,
-                    "slowmode_delay": tchannel.slowmode_delay,
-                    "nsfw": tchannel.is_nsfw(),
-                    "messages": [{
-                        "id": str(message.id),
-                        "content": message.system_content,
-                        "author": {
-                            "id": str(message.author.id),
-                            "name": message.author.name,
-                            "discriminator": message.author.discriminator,
-                            "avatar_url": str(message.author.avatar_url)
-                        },
-                        "pinned": message.pinned,
-                        "attachments": [attach.url for attach in message.attachments],
-                        "embeds": [embed.to_dict() for embed in message.embeds],
-                        "reactions": [
-                            str(reaction.emoji.name)
-                            if isinstance(reaction.emoji, discord.Emoji) else str(reaction.emoji)
-                            for reaction in message.reactions
-                        ],
-
-                    } for message in reversed(await tchannel.history(limit=self.chatlog).flatten())],
-
-                    "webhooks": [{
-                        "channel": str(webhook.channel.id),
-                        "name": webhook.name,
-                        "avatar": str(webhook.avatar_url),
-                        "url": webhook.url
-
-                    } for webhook in await tchannel.webhooks()]
-                })
-            except:
-                traceback.print_exc()
+    async def _save_text_channels(self):
+        async for channel in utils.map_limited(self._save_text_channel, self.snapshot.text_channels,
+                                               limit=self.concurrency):
+            if channel is not None:
+                yield channel
 
-        for vchannel in self.guild.voice_channels:
+    async def _save_voice_channels(self):
+        for vchannel in self.snapshot.voice_channels:
             try:
-                self.data["voice_channels"].append({
+                yield {
                     "name": vchannel.name,
                     "position": vchannel.position,
-                    "category": None if vchannel.category is None else str(vchannel.category.id),
-                    "id": str(vchannel.id),
-                    "overwrites": self._overwrites_to_json(vchannel.overwrites),
+                    "category": vchannel.category_key,
+                    "id": vchannel.key,
+                    "overwrites": vchannel.overwrites_json(),
                     "bitrate": vchannel.bitrate,
                     "user_limit": vchannel.user_limit,
-                })
+                }
             except:
-                traceback.print_exc()
+                self._error("voice_channel")
 
     async def _save_roles(self):
-        for role in self.guild.roles:
+        for role in self.snapshot.roles:
             try:
                 if role.managed:
                     continue
 
-                self.data["roles"].append({
-                    "id": str(role.id),
-                    "default": role.is_default(),
+                yield {
+                    "id": role.key,
+                    "default": role.default,
                     "name": role.name,
-                    "permissions": role.permissions.value,
-                    "color": role.color.value,
+                    "permissions": role.permissions,
+                    "color": role.color,
                     "hoist": role.hoist,
                     "position": role.position,
                     "mentionable": role.mentionable
-                })
+                }
             except:
-                traceback.print_exc()
+                self._error("role")
 
     async def _save_members(self):
-        for member in sorted(self.guild.members, key=lambda m: len(m.roles), reverse=True)[:1000]:
+        if self.all_members:
+            async for member in self._save_all_members():
+                yield member
+
+            return
+
+        # Same result as sorting all members and taking the first 1000, without sorting a copy of the member list
+        for member in heapq.nlargest(1000, self.guild.members, key=lambda m: len(m.roles)):
             try:
-                self.data["members"].append({
+                yield {
                     "id": str(member.id),
                     "name": member.name,
                     "discriminator": member.discriminator,
                     "nick": member.nick,
                     "roles": [str(role.id) for role in member.roles[1:] if not role.managed]
-                })
+                }
             except:
-                traceback.print_exc()
+                self._error("member")
 
-    async def _save_bans(self):
-        for reason, user in await self.guild.bans():
+    async def _save_all_members(self):
+        # Every member that has a role or a nick, in a compact form that only contains
+        # what the loader restores ("nick" is left out if it isn't set)
+        if not self.guild.chunked and self.guild.large:
+            self.observer.api_call("member", "request_offline")
+            await self.bot.request_offline_members(self.guild)
+
+        for member in self.guild.members:
             try:
-                self.data["bans"].append({
-                    "user": str(user.id),
-                    "reason": reason
-                })
+                roles = [str(role.id) for role in member.roles[1:] if not role.managed]
+                if len(roles) == 0 and member.nick is None:
+                    continue
+
+                entry = {"id": str(member.id), "roles": roles}
+                if member.nick is not None:
+                    entry["nick"] = member.nick
+
+                yield entry
             except:
-                # User probably doesn't exist anymore
-                traceback.print_exc()
+                self._error("member")
 
-    async def save(self, chatlog=20):
-        self.chatlog = chatlog
-        self.data = {
+    async def _save_bans(self):
+        # Paged, only one page of the ban list is held at a time
+        async for page in utils.ban_pages(self.bot.http, self.guild.id, self.observer):
+            for ban in page:
+                try:
+                    yield {
+                        "user": ban["user"]["id"],
+                        "reason": ban["reason"]
+                    }
+                except:
+                    self._error("ban")
+
+    def _save_settings(self):
+        return {
             "id": str(self.guild.id),
             "name": self.guild.name,
             "icon_url": str(self.guild.icon_url),
@@ -145,70 +201,259 @@ class BackupSaver():
             "verification_level": str(self.guild.verification_level),
             "explicit_content_filter": str(self.guild.explicit_content_filter),
             "large": self.guild.large,
-
-            "text_channels": [],
-            "voice_channels": [],
-            "categories": [],
-            "roles": [],
-            "members": [],
-            "bans": [],
         }
 
-        execution_order = [self._save_roles, self._save_channels, self._save_members, self._save_bans]
-
-        for method in execution_order:
+    async def stream(self, chatlog=20, concurrency=1, all_members=False):
+        # Yields the backup as (section, entry) pairs instead of building it in memory.
+        # The first pair is ("settings", dict of the top level values), every following one
+        # is an entry of one of the SECTIONS lists.
+        self.chatlog = chatlog
+        self.concurrency = concurrency
+        self.all_members = all_members
+        self._fetching = self.semaphore or asyncio.Semaphore(max(concurrency, 1))
+        if self.archiver is not None and self.archiver.session is None:
+            self.archiver.session = self.session
+        self.summary = Summary()
+        self.snapshot = capture(self.guild) if self.snapshots is None else self.snapshots.get(self.guild)
+        settings = self._save_settings()
+        self.summary.add("settings", settings)
+        yield "settings", settings
+
+        execution_order = [
+            ("roles", self._save_roles),
+            ("categories", self._save_categories),
+            ("text_channels", self._save_text_channels),
+            ("voice_channels", self._save_voice_channels),
+            ("members", self._save_members),
+            ("bans", self._save_bans),
+        ]
+
+        for section, method in execution_order:
+            # The duration includes the time the consumer of the stream spends on the entries
+            phase = method.__name__.lstrip("_")
+            self.observer.phase_started(phase)
+            start = time.perf_counter()
             try:
-                await method()
-            except:
-                traceback.print_exc()
+                async for entry in method():
+                    self.summary.add(section, entry)
+                    yield section, entry
+            except Exception:
+                self._error(section)
+            finally:
+                self.observer.phase_finished(phase, time.perf_counter() - start)
+
+    async def save(self, chatlog=20, concurrency=1, all_members=False):
+        self.data = {}
+        async for section, entry in self.stream(chatlog, concurrency, all_members):
+            if section == "settings":
+                self.data.update(entry)
+                self.data.update({key: [] for key in SECTIONS})
+            else:
+                self.data[section].append(entry)
 
         return self.data
 
+    async def save_delta(self, base, chatlog=20, concurrency=1, all_members=False):
+        # Only fetches the messages that are newer than the ones stored in base and returns
+        # the changes against it. delta.apply(base, changes) returns the full backup.
+        # saver.summary only counts the new messages, summarize the applied backup for the catalog.
+        self.after = {
+            channel["id"]: channel["messages"][-1]["id"]
+            for channel in base["text_channels"]
+            if len(channel["messages"]) != 0
+        }
+        if self.archiver is not None:
+            for channel in base["text_channels"]:
+                self.archiver.remember(channel["messages"])
+
+        try:
+            data = await self.save(chatlog, concurrency, all_members)
+        finally:
+            self.after = {}
+
+        return delta.diff(base, data, chatlog=chatlog)
+
+    async def save_to(self, fp, chatlog=20, concurrency=1, all_members=False):
+        # Writes the JSON document save() would return to fp, one entry at a time.
+        # fp needs a write(str) method (e.g. open(path, "w") or gzip.open(path, "wt")),
+        # awaitable results of write are awaited.
+        async def write(chunk):
+            result = fp.write(chunk)
+            if inspect.isawaitable(result):
+                await result
+
+        current = None
+        written = set()
+        async for section, entry in self.stream(chatlog, concurrency, all_members):
+            if section == "settings":
+                await write(json.dumps(entry)[:-1])
+                continue
+
+            if section != current:
+                await write(("]" if current is not None else "") + ", " + json.dumps(section) + ": [")
+                current = section
+                written.add(section)
+            else:
+                await write(", ")
+
+            await write(json.dumps(entry))
+
+        if current is not None:
+            await write("]")
+
+        for section in SECTIONS:
+            if section not in written:
+                await write(", " + json.dumps(section) + ": []")
+
+        await write("}")
+
     def __dict__(self):
         return self.data
 
 
+class MemberStats:
+    def __init__(self):
+        # Members that were edited
+        self.touched = 0
+        # Members that already matched the backup
+        self.skipped = 0
+        # Members that aren't in the backup
+        self.missing = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return (f"<MemberStats touched={self.touched} skipped={self.skipped} missing={self.missing} "
+                f"failed={self.failed}>")
+
+
+class BanStats:
+    def __init__(self):
+        self.banned = 0
+        # Users that were banned already
+        self.skipped = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return f"<BanStats banned={self.banned} skipped={self.skipped} failed={self.failed}>"
+
+
 class BackupLoader:
-    def __init__(self, bot, session, data):
+    def __init__(self, bot, session, data, observer=None):
         self.session = session
         self.data = data
         self.bot = bot
+        self.observer = observer or Observer()
         self.id_translator = {}
         self.options = {"settings": True, "channels": True, "roles": True}
+        self.concurrency = 1
+        self.semaphore = asyncio.Semaphore(1)
+        self.replayer = ChatlogReplayer(observer=self.observer)
+        self._chatlog_jobs = []
+        # TeardownStats of the deletes before the load
+        self.teardown_stats = utils.TeardownStats()
+        self.member_stats = MemberStats()
+        self.ban_stats = BanStats()
+        self.checkpoint = None
+        # Seconds between two checkpoints, they are also saved after every completed step
+        self.checkpoint_interval = 1
+        self._steps = set()
+        # Ids of the created channels whose chatlog was replayed
+        self._replayed = set()
+
+    def _error(self, entity):
+        self.observer.error(entity, sys.exc_info())
+
+    @property
+    def chatlog_stats(self):
+        return self.replayer.stats
+
+    async def _gather(self, coros):
+        # All API work of a load shares one semaphore, so the concurrency limit
+        # holds even when several phases run at the same time
+        return await utils.gather_limited(coros, semaphore=self.semaphore)
+
+    def _checkpoint_state(self):
+        return {
+            "steps": sorted(self._steps),
+            "id_translator": self.id_translator,
+            "replayed": sorted(self._replayed),
+        }
+
+    async def _save_checkpoint(self):
+        if self.checkpoint is None:
+            return
+
+        try:
+            await self.checkpoint.save(self.checkpoint_key, self._checkpoint_state())
+        except:
+            self._error("checkpoint")
+
+    async def _restore_checkpoint(self):
+        state = await self.checkpoint.load(self.checkpoint_key)
+        if state is None:
+            return
+
+        self._steps = set(state["steps"])
+        self._replayed = set(state["replayed"])
+        # Entities that were deleted since the checkpoint are created again
+        self.id_translator = {
+            backup_id: target_id
+            for backup_id, target_id in state["id_translator"].items()
+            if self.guild.get_role(target_id) is not None or self.guild.get_channel(target_id) is not None
+        }
+
+    async def _autosave_checkpoint(self):
+        # Entities completed after the last checkpoint are created again when the load is resumed
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            await self._save_checkpoint()
+
+    async def _run_stage(self, methods):
+        async def _run(method):
+            phase = method.__name__.lstrip("_")
+            if phase in self._steps:
+                return
+
+            self.observer.phase_started(phase)
+            start = time.perf_counter()
+            try:
+                await method()
+                self._steps.add(phase)
+                await self._save_checkpoint()
+            except:
+                self._error(phase)
+            finally:
+                self.observer.phase_finished(phase, time.perf_counter() - start)
+
+        await asyncio.gather(*[_run(method) for method in methods])
 
     def _overwrites_from_json(self, json):
         overwrites = {}
         for union_id, overwrite in json.items():
             union = self.guild.get_member(int(union_id))
             if union is None:
-                roles = list(
-                    filter(lambda r: r.id == self.id_translator.get(union_id), self.guild.roles))
-                if len(roles) == 0:
+                # Guild.get_role is a dict lookup
+                union = self.guild.get_role(self.id_translator.get(union_id))
+                if union is None:
                     continue
 
-                union = roles[0]
-
             overwrites[union] = discord.PermissionOverwrite(**overwrite)
 
         return overwrites
 
     async def _prepare_guild(self):
+        entities = []
         if self.options.get("roles"):
-            for role in self.guild.roles:
-                if not role.managed and not role.is_default():
-                    try:
-                        await role.delete(reason=self.reason)
-                    except:
-                        traceback.print_exc()
+            entities.extend(("role", role) for role in self.guild.roles if not role.managed and not role.is_default())
 
         if self.options.get("channels"):
-            for channel in self.guild.channels:
-                try:
-                    await channel.delete(reason=self.reason)
-                except:
-                    traceback.print_exc()
+            entities.extend(("channel", channel) for channel in self.guild.channels)
+
+        with self.observer.phase("prepare_guild"):
+            self.teardown_stats = await utils.teardown(entities, self.observer, self.reason, semaphore=self.semaphore)
 
     async def _load_settings(self):
+        self.observer.api_call("guild", "edit")
         await self.guild.edit(
             name=self.data["name"],
             region=discord.VoiceRegion(self.data["region"]),
@@ -219,178 +464,303 @@ class BackupLoader:
                 self.id_translator.get(self.data["system_channel"]))
         )
 
+    async def _load_role(self, role):
+        try:
+            if role["default"]:
+                self.observer.api_call("role", "edit")
+                await self.guild.default_role.edit(
+                    permissions=discord.Permissions(role["permissions"])
+                )
+                created = self.guild.default_role
+            else:
+                self.observer.api_call("role", "create")
+                created = await self.guild.create_role(
+                    name=role["name"],
+                    hoist=role["hoist"],
+                    mentionable=role["mentionable"],
+                    color=discord.Color(role["color"]),
+                    permissions=discord.Permissions(role["permissions"])
+                )
+
+            self.id_translator[role["id"]] = created.id
+        except:
+            self._error("role")
+
     async def _load_roles(self):
+        # Sequential, the creation order defines the hierarchy
         for role in reversed(self.data["roles"]):
+            if role["id"] not in self.id_translator:
+                await self._load_role(role)
+
+        await self._load_role_positions()
+
+    async def _load_role_positions(self):
+        # The creation order already gives the right hierarchy if every role could be created. Everything else
+        # (failed creates, resumed loads, existing roles) is put in place with one bulk call.
+        roles = sorted(
+            (role for role in self.data["roles"] if not role["default"] and role["id"] in self.id_translator),
+            key=lambda role: role["position"]
+        )
+        positions = utils.role_position_updates(self.guild, [self.id_translator[role["id"]] for role in roles])
+        if positions is not None:
             try:
-                if role["default"]:
-                    await self.guild.default_role.edit(
-                        permissions=discord.Permissions(role["permissions"])
-                    )
-                    created = self.guild.default_role
-                else:
-                    created = await self.guild.create_role(
-                        name=role["name"],
-                        hoist=role["hoist"],
-                        mentionable=role["mentionable"],
-                        color=discord.Color(role["color"]),
-                        permissions=discord.Permissions(role["permissions"])
-                    )
-
-                self.id_translator[role["id"]] = created.id
+                self.observer.api_call("role", "positions")
+                await self.bot.http.move_role_position(self.guild.id, positions, reason=self.reason)
             except:
-                traceback.print_exc()
+                self._error("role")
+
+    async def _load_category(self, category):
+        try:
+            self.observer.api_call("category", "create")
+            created = await self.guild.create_category_channel(
+                name=category["name"],
+                overwrites=self._overwrites_from_json(category["overwrites"])
+            )
+            self.id_translator[category["id"]] = created.id
+        except:
+            self._error("category")
 
     async def _load_categories(self):
-        for category in self.data["categories"]:
-            try:
-                created = await self.guild.create_category_channel(
-                    name=category["name"],
-                    overwrites=self._overwrites_from_json(category["overwrites"])
-                )
-                self.id_translator[category["id"]] = created.id
-            except:
-                traceback.print_exc()
+        await self._gather([
+            self._load_category(category)
+            for category in self.data["categories"]
+            if category["id"] not in self.id_translator
+        ])
+
+    async def _load_text_channel(self, tchannel):
+        try:
+            created = await utils.create_channel(
+                self.observer,
+                "text_channel",
+                self.guild.create_text_channel,
+                {
+                    "topic": tchannel["topic"],
+                    "nsfw": tchannel["nsfw"],
+                    "slowmode_delay": tchannel.get("slowmode_delay", 0),
+                    "position": tchannel["position"],
+                },
+                name=tchannel["name"],
+                overwrites=self._overwrites_from_json(tchannel["overwrites"]),
+                category=discord.Object(self.id_translator.get(tchannel["category"]))
+            )
+
+            if self.chatlog != 0:
+                self._chatlog_jobs.append((created, tchannel["messages"][-self.chatlog:]))
+
+            self.id_translator[tchannel["id"]] = created.id
+        except:
+            self._error("text_channel")
 
     async def _load_text_channels(self):
+        # The chatlogs are replayed after all text channels exist, so creating channels isn't held up by them
+        self._chatlog_jobs = []
         for tchannel in self.data["text_channels"]:
-            try:
-                created = await self.guild.create_text_channel(
-                    name=tchannel["name"],
-                    overwrites=self._overwrites_from_json(tchannel["overwrites"]),
-                    category=discord.Object(self.id_translator.get(tchannel["category"]))
-                )
-                await created.edit(
-                    topic=tchannel["topic"],
-                    nsfw=tchannel["nsfw"],
-                )
-
-                if self.chatlog != 0:
-                    webh = await created.create_webhook(name="chatlog")
-                    for message in tchannel["messages"][-self.chatlog:]:
-                        attachments = []
-                        for attachment in message["attachments"]:
-                            emb = discord.Embed()
-                            emb.set_image(url=attachment)
-                            attachments.append(emb)
-
-                        try:
-                            await webh.send(
-                                username=message["author"]["name"],
-                                avatar_url=message["author"]["avatar_url"],
-                                content=utils.clean_content(message["content"]),
-                                embeds=[discord.Embed.from_dict(embed)
-                                        for embed in message["embeds"]] + attachments
-                            )
-                        except:
-                            # Content and embeds are probably empty
-                            traceback.print_exc()
-
-                    await webh.delete()
-
-                self.id_translator[tchannel["id"]] = created.id
-            except:
-                traceback.print_exc()
+            # Channels of a resumed load that were created but whose chatlog wasn't replayed completely,
+            # an interrupted replay starts over
+            created = self.guild.get_channel(self.id_translator.get(tchannel["id"]))
+            if created is not None and created.id not in self._replayed and self.chatlog != 0:
+                self._chatlog_jobs.append((created, tchannel["messages"][-self.chatlog:]))
+
+        await self._gather([
+            self._load_text_channel(tchannel)
+            for tchannel in self.data["text_channels"]
+            if tchannel["id"] not in self.id_translator
+        ])
+        await self.replayer.replay_all(self._chatlog_jobs, done=lambda channel: self._replayed.add(channel.id))
+
+    async def _load_voice_channel(self, vchannel):
+        try:
+            created = await utils.create_channel(
+                self.observer,
+                "voice_channel",
+                self.guild.create_voice_channel,
+                {
+                    "bitrate": vchannel["bitrate"],
+                    "user_limit": vchannel["user_limit"],
+                    "position": vchannel["position"],
+                },
+                name=vchannel["name"],
+                overwrites=self._overwrites_from_json(vchannel["overwrites"]),
+                category=discord.Object(self.id_translator.get(vchannel["category"]))
+            )
+            self.id_translator[vchannel["id"]] = created.id
+        except:
+            self._error("voice_channel")
 
     async def _load_voice_channels(self):
-        for vchannel in self.data["voice_channels"]:
+        await self._gather([
+            self._load_voice_channel(vchannel)
+            for vchannel in self.data["voice_channels"]
+            if vchannel["id"] not in self.id_translator
+        ])
+
+    async def _load_channel_positions(self):
+        # Concurrent creates end up in any order, the saved positions are applied with one bulk call
+        wanted = []
+        for channel in self.data["categories"] + self.data["text_channels"] + self.data["voice_channels"]:
+            target_id = self.id_translator.get(channel["id"])
+            if target_id is not None:
+                target = self.guild.get_channel(target_id)
+                wanted.append((target_id, getattr(target, "position", None), channel["position"]))
+
+        positions = utils.position_updates(wanted)
+        if positions is not None:
+            self.observer.api_call("channel", "positions")
+            await self.bot.http.bulk_channel_update(self.guild.id, positions, reason=self.reason)
+
+    async def _load_ban(self, ban):
+        async with self.semaphore:
             try:
-                created = await self.guild.create_voice_channel(
-                    name=vchannel["name"],
-                    overwrites=self._overwrites_from_json(vchannel["overwrites"]),
-                    category=discord.Object(self.id_translator.get(vchannel["category"]))
-                )
-                await created.edit(
-                    bitrate=vchannel["bitrate"],
-                    user_limit=vchannel["user_limit"]
-                )
-                self.id_translator[vchannel["id"]] = created.id
+                self.observer.api_call("ban", "create")
+                await self.guild.ban(user=discord.Object(int(ban["user"])), reason=ban["reason"])
+                self.ban_stats.banned += 1
             except:
-                traceback.print_exc()
-
-    async def _load_channels(self):
-        await self._load_categories()
-        await self._load_text_channels()
-        await self._load_voice_channels()
+                # User probably doesn't exist anymore
+                self.ban_stats.failed += 1
+                self._error("ban")
 
     async def _load_bans(self):
-        for ban in self.data["bans"]:
+        # Users that are banned already are skipped, so a load that stopped during the bans continues
+        # where it stopped. Bans are applied through a sliding window instead of a task per ban.
+        self.ban_stats = BanStats()
+        banned = await utils.banned_ids(self.bot.http, self.guild.id, self.observer)
+        bans = [ban for ban in self.data["bans"] if int(ban["user"]) not in banned]
+        self.ban_stats.skipped = len(self.data["bans"]) - len(bans)
+        async for _ in utils.map_limited(self._load_ban, bans, limit=self.concurrency):
+            pass
+
+    def _member_changes(self, member, fit):
+        # Returns the member.edit kwargs that restore the member, empty if nothing has to change
+        current_roles = {r.id for r in member.roles}
+        roles = [
+            discord.Object(self.id_translator[role])
+            for role in fit["roles"]
+            if role in self.id_translator and self.id_translator[role] not in current_roles
+        ]
+        changes = {}
+        if len(roles) != 0:
+            changes["roles"] = member.roles + roles
+
+        if member.nick != fit.get("nick"):
+            changes["nick"] = fit.get("nick")
+
+        return changes
+
+    async def _load_member_changes(self, member, changes):
+        try:
             try:
-                await self.guild.ban(user=discord.Object(int(ban["user"])), reason=ban["reason"])
-            except:
-                # User probably doesn't exist anymore
-                traceback.print_exc()
+                self.observer.api_call("member", "edit")
+                await member.edit(reason=self.reason, **changes)
+            except discord.Forbidden:
+                # Probably the nick of a member above the bot, the roles can still be added
+                if "roles" not in changes:
+                    raise
+
+                current_roles = {r.id for r in member.roles}
+                self.observer.retry("member", "add_roles", 1)
+                self.observer.api_call("member", "add_roles")
+                await member.add_roles(*[role for role in changes["roles"] if role.id not in current_roles],
+                                       reason=self.reason)
+
+            self.member_stats.touched += 1
+        except:
+            self.member_stats.failed += 1
+            self._error("member")
 
     async def _load_member(self):
+        # The changes of every member are computed up front, members that already match the backup cost
+        # no call. Edits share one rate limit bucket per guild which discord.py waits for.
+        self.member_stats = MemberStats()
+        # Index the backup once instead of scanning it for every member of the guild
+        members = {member["id"]: member for member in self.data["members"]}
+        edits = []
         for member in self.guild.members:
             try:
-                fits = list(filter(lambda m: m["id"] == str(member.id), self.data["members"]))
-                if len(fits) == 0:
+                fit = members.get(str(member.id))
+                if fit is None:
+                    self.member_stats.missing += 1
                     continue
 
-                current_roles = [r.id for r in member.roles]
-                roles = [
-                    discord.Object(self.id_translator.get(role))
-                    for role in fits[0]["roles"]
-                    if role in self.id_translator and role not in current_roles
-                ]
-
-                try:
-                    await member.edit(
-                        nick=fits[0].get("nick"),
-                        roles=member.roles + roles,
-                        reason=self.reason
-                    )
-                except discord.Forbidden:
-                    await member.add_roles(*roles)
+                changes = self._member_changes(member, fit)
+                if len(changes) == 0:
+                    self.member_stats.skipped += 1
+                    continue
 
+                edits.append((member, changes))
             except:
-                traceback.print_exc()
+                self.member_stats.failed += 1
+                self._error("member")
+
+        await self._gather([self._load_member_changes(member, changes) for member, changes in edits])
 
-    async def load(self, guild, loader: discord.User, chatlog, **options):
+    async def load(self, guild, loader: discord.User, chatlog, concurrency=1, checkpoint=None, job_id=None,
+                   **options):
+        # With a CheckpointStore passed as checkpoint, the progress is saved under job_id (defaults to
+        # "<backup id>-<guild id>") and a load that was interrupted continues where it stopped when
+        # it's started again. The checkpoint is removed once the load finished.
         self.guild = guild
         self.chatlog = chatlog
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self.replayer = ChatlogReplayer(concurrency, observer=self.observer)
         if len(options) != 0:
             self.options = options
 
         self.loader = loader
         self.reason = f"Backup loaded by {loader}"
 
-        await self._prepare_guild()
-        if self.options.get("roles"):
-            try:
-                await self._load_roles()
-            except:
-                traceback.print_exc()
+        # Each stage only depends on the stages before it (channels need the translated role ids
+        # for their overwrites, settings need the translated channel ids, members need the roles),
+        # so the phases inside one stage run concurrently.
+        # Per-route rate limits and 429 retries are handled by discord.py's HTTP client.
+        execution_order = [
+            [("roles", self._load_roles)],
+            [("channels", self._load_categories)],
+            [("channels", self._load_text_channels), ("channels", self._load_voice_channels)],
+            [("settings", self._load_settings), ("bans", self._load_bans), ("members", self._load_member),
+             ("channels", self._load_channel_positions)],
+        ]
+
+        # Progress of an earlier load is only carried over through a checkpoint
+        self._steps = set()
+        self._replayed = set()
+        self.id_translator = {}
+        self.checkpoint = checkpoint
+        self.checkpoint_key = job_id or f"{self.data['id']}-{guild.id}"
+        autosave = None
+        if checkpoint is not None:
+            await self._restore_checkpoint()
+            autosave = asyncio.ensure_future(self._autosave_checkpoint())
 
-        if self.options.get("channels"):
-            try:
-                await self._load_channels()
-            except:
-                traceback.print_exc()
+        try:
+            if "prepare_guild" not in self._steps:
+                await self._prepare_guild()
+                self._steps.add("prepare_guild")
+                await self._save_checkpoint()
 
-        if self.options.get("settings"):
-            try:
-                await self._load_settings()
-            except:
-                traceback.print_exc()
+            for stage in execution_order:
+                await self._run_stage([method for option, method in stage if self.options.get(option)])
+        except BaseException:
+            if autosave is not None:
+                autosave.cancel()
+                await self._save_checkpoint()
 
-        if self.options.get("bans"):
-            try:
-                await self._load_bans()
-            except:
-                traceback.print_exc()
+            raise
 
-        if self.options.get("members"):
-            try:
-                await self._load_member()
-            except:
-                traceback.print_exc()
+        if autosave is not None:
+            autosave.cancel()
+            await checkpoint.clear(self.checkpoint_key)
 
 
 class BackupInfo():
+    # The rendered channels and roles are cached per limit, data must not change afterwards
+
     def __init__(self, bot, data):
         self.bot = bot
         self.data = data
+        self._tree = None
+        self._rendered = {}
+        self._chatlog = None
 
     @property
     def icon_url(self):
@@ -400,37 +770,71 @@ class BackupInfo():
     def name(self):
         return self.data["name"]
 
-    def channels(self, limit=1000):
-        ret = "```"
-        for channel in self.data["text_channels"]:
-            if channel.get("category") is None:
-                ret += "\n#\u200a" + channel["name"]
+    def _channel_tree(self):
+        # Category id (None for channels without one) -> (text channel names, voice channel names), built once
+        if self._tree is None:
+            tree = {None: ([], [])}
+            for category in self.data["categories"]:
+                tree[category["id"]] = ([], [])
 
-        for channel in self.data["voice_channels"]:
-            if channel.get("category") is None:
-                ret += "\n \u200a" + channel["name"]
+            for section, index in (("text_channels", 0), ("voice_channels", 1)):
+                for channel in self.data[section]:
+                    names = tree.get(channel.get("category"))
+                    if names is not None:
+                        names[index].append(channel["name"])
 
-        ret += "\n"
-        for category in self.data["categories"]:
-            ret += "\n⯆\u200a" + category["name"]
-            for channel in self.data["text_channels"]:
-                if channel.get("category") == category["id"]:
-                    ret += "\n  #\u200a" + channel["name"]
+            self._tree = tree
 
-            for channel in self.data["voice_channels"]:
-                if channel.get("category") == category["id"]:
-                    ret += "\n   \u200a" + channel["name"]
+        return self._tree
 
-            ret += "\n"
+    def _channel_lines(self):
+        tree = self._channel_tree()
+        text, voice = tree[None]
+        for name in text:
+            yield "\n#\u200a" + name
 
-        return ret[:limit - 10] + "```"
+        for name in voice:
+            yield "\n \u200a" + name
 
-    def roles(self, limit=1000):
-        ret = "```"
+        yield "\n"
+        for category in self.data["categories"]:
+            yield "\n⯆\u200a" + category["name"]
+            text, voice = tree[category["id"]]
+            for name in text:
+                yield "\n  #\u200a" + name
+
+            for name in voice:
+                yield "\n   \u200a" + name
+
+            yield "\n"
+
+    def _role_lines(self):
         for role in reversed(self.data["roles"]):
-            ret += "\n" + role["name"]
+            yield "\n" + role["name"]
 
-        return ret[:limit - 10] + "```"
+    def _render(self, kind, lines, limit):
+        # Stops rendering once the limit is reached instead of truncating the full text
+        key = (kind, limit)
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            parts = ["```"]
+            length = 3
+            for line in lines:
+                if 0 <= limit - 10 <= length:
+                    break
+
+                parts.append(line)
+                length += len(line)
+
+            rendered = self._rendered[key] = "".join(parts)[:limit - 10] + "```"
+
+        return rendered
+
+    def channels(self, limit=1000):
+        return self._render("channels", self._channel_lines(), limit)
+
+    def roles(self, limit=1000):
+        return self._render("roles", self._role_lines(), limit)
 
     @property
     def member_count(self):
@@ -438,9 +842,7 @@ class BackupInfo():
 
     @property
     def chatlog(self):
-        max_messages = 0
-        for channel in self.data["text_channels"]:
-            if len(channel["messages"]) > max_messages:
-                max_messages = len(channel["messages"])
+        if self._chatlog is None:
+            self._chatlog = max((len(channel["messages"]) for channel in self.data["text_channels"]), default=0)
 
-        return max_messages
+        return self._chatlog
@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import itertools
+import sys
+import time
+
+from .backups import BackupSaver
+from .metrics import Observer
+
+__all__ = ("BackupBatch", "BatchResult")
+
+
+class BatchResult:
+    def __init__(self, guild, priority):
+        self.guild = guild
+        self.priority = priority
+        # The backup, None if saving the guild failed
+        self.data = None
+        self.error = None
+        # Entities (channels, roles, ...) that failed while saving the guild, data lacks them
+        self.errors = 0
+        self.duration = 0
+
+    @property
+    def ok(self):
+        return self.error is None and self.errors == 0
+
+    def __repr__(self):
+        state = "ok" if self.ok else f"error={self.error!r} errors={self.errors}"
+        return f"<BatchResult guild={self.guild.id} {state} duration={self.duration:.2f}s>"
+
+
+class _GuildObserver(Observer):
+    # Passes everything on to the batch's observer, counts the errors of one guild and reports them
+    # through guild_error so the shared observer can tell the guilds apart
+    def __init__(self, observer, guild_id):
+        self.observer = observer
+        self.guild_id = guild_id
+        self.errors = 0
+
+    def phase_started(self, phase):
+        self.observer.phase_started(phase)
+
+    def phase_finished(self, phase, duration):
+        self.observer.phase_finished(phase, duration)
+
+    def api_call(self, entity, action):
+        self.observer.api_call(entity, action)
+
+    def retry(self, entity, action, attempt):
+        self.observer.retry(entity, action, attempt)
+
+    def rate_limited(self, bucket, wait):
+        self.observer.rate_limited(bucket, wait)
+
+    def error(self, entity, exc_info):
+        self.errors += 1
+        self.observer.guild_error(self.guild_id, entity, exc_info)
+
+
+class BackupBatch:
+    # Saves many guilds with one bounded pool of workers instead of a task per guild.
+    #   workers       guilds that are saved at the same time
+    #   concurrency   channels fetched at the same time within one guild
+    #   max_requests  channels fetched at the same time across all guilds (None for workers * concurrency)
+    # Guilds with a higher priority are saved first, equal priorities in the order they were added.
+    # All savers share the bot, session, observer and the optional SnapshotCache, errors are reported to
+    # the observer with observer.guild_error.
+
+    def __init__(self, bot, session, workers=4, concurrency=1, max_requests=None, observer=None, snapshots=None):
+        self.bot = bot
+        self.session = session
+        self.workers = workers
+        self.concurrency = concurrency
+        self.max_requests = max_requests
+        self.observer = observer or Observer()
+        self.snapshots = snapshots
+        self._queue = []
+        self._order = itertools.count()
+        self._queued = set()
+        self._running = False
+        self._closed = False
+        # Set when guilds are added or the batch is closed while it runs
+        self._changed = None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, guild, priority=0, chatlog=20, all_members=False, concurrency=None):
+        # Guilds that are already queued are ignored. concurrency overrides the batch's per guild limit
+        # for this guild. Guilds can only be added to a running batch if it was started with
+        # stream(keep_open=True) and isn't closed yet.
+        if self._running and self._closed:
+            raise RuntimeError("The batch is running and closed, guilds can't be added anymore")
+
+        if guild.id in self._queued:
+            return
+
+        self._queued.add(guild.id)
+        job = (guild, chatlog, all_members, concurrency or self.concurrency)
+        heapq.heappush(self._queue, (-priority, next(self._order), job))
+        if self._changed is not None:
+            self._changed.set()
+
+    def close(self):
+        # Lets a batch started with keep_open=True finish once the queued guilds are saved
+        self._closed = True
+        if self._changed is not None:
+            self._changed.set()
+
+    async def _save(self, priority, guild, chatlog, all_members, concurrency, semaphore):
+        result = BatchResult(guild, priority)
+        observer = _GuildObserver(self.observer, guild.id)
+        saver = BackupSaver(self.bot, self.session, guild, observer)
+        saver.semaphore = semaphore
+        saver.snapshots = self.snapshots
+        start = time.perf_counter()
+        try:
+            if guild.unavailable:
+                raise RuntimeError(f"Guild {guild.id} is unavailable")
+
+            result.data = await saver.save(chatlog, concurrency, all_members)
+        except Exception as e:
+            result.error = e
+            observer.error("guild", sys.exc_info())
+        finally:
+            result.errors = observer.errors
+            result.duration = time.perf_counter() - start
+
+        return result
+
+    async def stream(self, keep_open=False):
+        # Yields a BatchResult for every guild as soon as it's saved. With keep_open=True the workers wait
+        # for more guilds (see add) until close() is called, otherwise the batch finishes with the queued guilds.
+        if self._running:
+            raise RuntimeError("The batch is running already")
+
+        max_requests = self.max_requests or max(self.workers, 1) * max(self.concurrency, 1)
+        semaphore = asyncio.Semaphore(max_requests)
+        results = asyncio.Queue()
+        self._running = True
+        self._closed = not keep_open
+        self._changed = asyncio.Event()
+
+        async def worker():
+            try:
+                while True:
+                    if len(self._queue) == 0:
+                        if self._closed:
+                            return
+
+                        self._changed.clear()
+                        await self._changed.wait()
+                        continue
+
+                    priority, _, job = heapq.heappop(self._queue)
+                    self._queued.discard(job[0].id)
+                    await results.put(await self._save(-priority, *job, semaphore))
+            finally:
+                await results.put(None)
+
+        count = self.workers if keep_open else min(self.workers, len(self._queue))
+        workers = [asyncio.ensure_future(worker()) for _ in range(max(count, 1))]
+        try:
+            running = len(workers)
+            while running != 0:
+                result = await results.get()
+                if result is None:
+                    running -= 1
+                else:
+                    yield result
+        finally:
+            for task in workers:
+                task.cancel()
+
+            self._running = False
+            self._closed = False
+            self._changed = None
+
+    async def run(self, keep_open=False):
+        # Returns {guild id: BatchResult}. Use stream() for large batches, this keeps every backup in memory.
+        return {result.guild.id: result async for result in self.stream(keep_open)}
@@ -0,0 +1,177 @@
+import json
+import sqlite3
+import time
+
+__all__ = ("BackupCatalog", "Summary", "summarize")
+
+COUNTED = ("text_channels", "voice_channels", "categories", "roles", "members", "bans")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id TEXT PRIMARY KEY,
+    guild_id TEXT,
+    name TEXT,
+    created REAL,
+    size INTEGER,
+    text_channels INTEGER,
+    voice_channels INTEGER,
+    categories INTEGER,
+    roles INTEGER,
+    members INTEGER,
+    bans INTEGER,
+    chatlog INTEGER,
+    messages INTEGER,
+    search TEXT,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS backups_guild ON backups (guild_id, created);
+CREATE INDEX IF NOT EXISTS backups_created ON backups (created);
+"""
+
+# Columns returned by list and search, everything except the summary json
+COLUMNS = ("id", "guild_id", "name", "created", "size") + COUNTED + ("chatlog", "messages")
+
+
+class Summary:
+    # Collects the summary of a backup from its (section, entry) pairs, see BackupSaver.stream.
+    # BackupSaver keeps one for the last backup it saved as saver.summary.
+
+    def __init__(self):
+        self.settings = {}
+        self.counts = dict.fromkeys(COUNTED, 0)
+        self.categories = []
+        # Category id (None for channels without one) -> text and voice channel names
+        self.channels = {None: {"text": [], "voice": []}}
+        self.roles = []
+        self.chatlog = 0
+        self.messages = 0
+
+    def add(self, section, entry):
+        if section == "settings":
+            self.settings = entry
+            return
+
+        self.counts[section] += 1
+        if section == "categories":
+            self.categories.append((entry["id"], entry["name"]))
+            self.channels.setdefault(entry["id"], {"text": [], "voice": []})
+
+        elif section in ("text_channels", "voice_channels"):
+            channels = self.channels.setdefault(entry.get("category"), {"text": [], "voice": []})
+            channels["text" if section == "text_channels" else "voice"].append(entry["name"])
+            if section == "text_channels":
+                self.chatlog = max(self.chatlog, len(entry["messages"]))
+                self.messages += len(entry["messages"])
+
+        elif section == "roles":
+            self.roles.append(entry["name"])
+
+    def to_dict(self):
+        return {
+            "guild_id": self.settings.get("id"),
+            "name": self.settings.get("name"),
+            "icon_url": self.settings.get("icon_url"),
+            "member_count": self.settings.get("member_count"),
+            "counts": dict(self.counts),
+            # [{"name": None for channels without a category, "text": [names], "voice": [names]}]
+            "channels": [{"name": None, **self.channels[None]}] + [
+                {"name": name, **self.channels[category_id]}
+                for category_id, name in self.categories
+            ],
+            # Highest role first
+            "roles": list(reversed(self.roles)),
+            "chatlog": self.chatlog,
+            "messages": self.messages,
+        }
+
+
+def summarize(data):
+    summary = Summary()
+    summary.add("settings", data)
+    for section in COUNTED:
+        for entry in data[section]:
+            summary.add(section, entry)
+
+    return summary.to_dict()
+
+
+class BackupCatalog:
+    # A SQLite index of backup summaries, so backups can be listed and searched without loading them.
+    # The backups themselves are stored elsewhere, the catalog only knows their ids.
+
+    def __init__(self, path=":memory:"):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, backup_id, summary, size=None, created=None):
+        # summary is a Summary, a dict returned by summarize or a full backup
+        if isinstance(summary, Summary):
+            summary = summary.to_dict()
+
+        elif "counts" not in summary:
+            summary = summarize(summary)
+
+        search = [summary["name"] or ""] + summary["roles"]
+        for category in summary["channels"]:
+            search.extend([category["name"] or ""] + category["text"] + category["voice"])
+
+        with self.db:
+            self.db.execute(
+                f"INSERT OR REPLACE INTO backups ({', '.join(COLUMNS)}, search, summary) "
+                f"VALUES ({', '.join('?' * (len(COLUMNS) + 2))})",
+                (
+                    str(backup_id), summary["guild_id"], summary["name"],
+                    time.time() if created is None else created, size,
+                    *[summary["counts"][section] for section in COUNTED],
+                    summary["chatlog"], summary["messages"],
+                    "\n".join(search).lower(), json.dumps(summary),
+                )
+            )
+
+        return summary
+
+    def remove(self, backup_id):
+        with self.db:
+            self.db.execute("DELETE FROM backups WHERE id = ?", (str(backup_id),))
+
+    def get(self, backup_id):
+        # The full summary including the channel tree and roles, None if the backup isn't in the catalog
+        row = self.db.execute(
+            f"SELECT {', '.join(COLUMNS)}, summary FROM backups WHERE id = ?", (str(backup_id),)
+        ).fetchone()
+        if row is None:
+            return None
+
+        result = dict(row)
+        result.update(json.loads(result.pop("summary")))
+        return result
+
+    def _select(self, where, params, limit, offset):
+        rows = self.db.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM backups {where} ORDER BY created DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset)
+        )
+        return [dict(row) for row in rows]
+
+    def list(self, guild_id=None, limit=50, offset=0):
+        # Newest first
+        if guild_id is None:
+            return self._select("", (), limit, offset)
+
+        return self._select("WHERE guild_id = ?", (str(guild_id),), limit, offset)
+
+    def search(self, query, guild_id=None, limit=50, offset=0):
+        # Backups whose guild, channel, category or role names contain query (case insensitive)
+        pattern = "%" + query.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        if guild_id is None:
+            return self._select("WHERE search LIKE ? ESCAPE '\\'", (pattern,), limit, offset)
+
+        return self._select("WHERE guild_id = ? AND search LIKE ? ESCAPE '\\'", (str(guild_id), pattern),
+                            limit, offset)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM backups").fetchone()[0]
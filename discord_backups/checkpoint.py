@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+
+__all__ = ("CheckpointStore", "MemoryStore", "FileStore")
+
+
+class CheckpointStore:
+    # Where BackupLoader keeps the progress of a load, so an interrupted load can be resumed.
+    # The state is a JSON serializable dict. Implement these for other backends (e.g. a database).
+
+    async def load(self, key):
+        raise NotImplementedError
+
+    async def save(self, key, state):
+        raise NotImplementedError
+
+    async def clear(self, key):
+        raise NotImplementedError
+
+
+class MemoryStore(CheckpointStore):
+    def __init__(self):
+        self.states = {}
+
+    async def load(self, key):
+        state = self.states.get(key)
+        return None if state is None else json.loads(state)
+
+    async def save(self, key, state):
+        self.states[key] = json.dumps(state)
+
+    async def clear(self, key):
+        self.states.pop(key, None)
+
+
+class FileStore(CheckpointStore):
+    # One JSON file per key in `directory`. The files are read and written in the default executor,
+    # saves that are requested while a write is running are combined into one write of the newest state.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Created on first use, so the store can be created outside of the event loop
+        self._lock = None
+        # Key -> serialized state that wasn't written yet
+        self._pending = {}
+
+    def _path(self, key):
+        return os.path.join(self.directory, "".join(c if c.isalnum() else "-" for c in str(key)) + ".json")
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, raw):
+        # Written to a temporary file first, so a crash while writing doesn't destroy the last checkpoint
+        with open(path + ".tmp", "w") as f:
+            f.write(raw)
+
+        os.replace(path + ".tmp", path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    @property
+    def lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        return self._lock
+
+    async def load(self, key):
+        async with self.lock:
+            return await self._run(self._read, self._path(key))
+
+    async def save(self, key, state):
+        # Serialized right away, the loader keeps changing the state while the write waits
+        self._pending[key] = json.dumps(state)
+        async with self.lock:
+            raw = self._pending.pop(key, None)
+            if raw is not None:
+                await self._run(self._write, self._path(key), raw)
+
+    async def clear(self, key):
+        self._pending.pop(key, None)
+        async with self.lock:
+            await self._run(self._remove, self._path(key))
@@ -0,0 +1,118 @@
+import collections.abc
+import json
+import zlib
+
+# A compact encoding of backups:
+#   - message authors are stored once in a table and referenced by their index
+#   - snowflake ids are stored as integers instead of strings
+#   - overwrites are stored as [id, values] pairs, so their ids can be integers too
+#   - the result is zlib compressed
+# decode(encode(data)) == data for every backup created by BackupSaver.
+
+MAGIC = b"DBC1"
+ID_KEYS = {"id", "owner", "category", "afk_channel", "channel", "user"}
+
+__all__ = ("encode", "decode")
+
+
+def _is_snowflake(value):
+    return isinstance(value, str) and value.isdigit() and str(int(value)) == value
+
+
+def _pack_id(value):
+    return int(value) if _is_snowflake(value) else value
+
+
+def _unpack_id(value):
+    return str(value) if isinstance(value, int) and not isinstance(value, bool) else value
+
+
+def _is_list(value):
+    return isinstance(value, collections.abc.Sequence) and not isinstance(value, (str, bytes))
+
+
+class _Packer:
+    def __init__(self):
+        self.authors = []
+        self._author_index = {}
+
+    def author(self, author):
+        row = (_pack_id(author["id"]), author["name"], author["discriminator"], author["avatar_url"])
+        index = self._author_index.get(row)
+        if index is None:
+            index = self._author_index[row] = len(self.authors)
+            self.authors.append(row)
+
+        return index
+
+    def pack(self, obj):
+        if isinstance(obj, dict):
+            packed = {}
+            for key, value in obj.items():
+                if key == "embeds":
+                    # Embed dicts are stored as they are
+                    packed[key] = list(value)
+                elif key == "author" and isinstance(value, dict):
+                    packed[key] = self.author(value)
+                elif key == "overwrites" and isinstance(value, dict):
+                    packed[key] = [[_pack_id(target), overwrite] for target, overwrite in value.items()]
+                elif key in ID_KEYS:
+                    packed[key] = _pack_id(value)
+                elif key == "roles" and _is_list(value) and all(isinstance(role, str) for role in value):
+                    packed[key] = [_pack_id(role) for role in value]
+                else:
+                    packed[key] = self.pack(value)
+
+            return packed
+
+        if _is_list(obj):
+            return [self.pack(value) for value in obj]
+
+        return obj
+
+
+class _Unpacker:
+    def __init__(self, authors):
+        self.authors = [
+            {"id": _unpack_id(id), "name": name, "discriminator": discriminator, "avatar_url": avatar_url}
+            for id, name, discriminator, avatar_url in authors
+        ]
+
+    def unpack(self, obj):
+        if isinstance(obj, dict):
+            unpacked = {}
+            for key, value in obj.items():
+                if key == "embeds":
+                    unpacked[key] = value
+                elif key == "author" and isinstance(value, int):
+                    unpacked[key] = dict(self.authors[value])
+                elif key == "overwrites" and isinstance(value, list):
+                    unpacked[key] = {_unpack_id(target): overwrite for target, overwrite in value}
+                elif key in ID_KEYS:
+                    unpacked[key] = _unpack_id(value)
+                elif key == "roles" and isinstance(value, list) and all(not isinstance(role, dict) for role in value):
+                    unpacked[key] = [_unpack_id(role) for role in value]
+                else:
+                    unpacked[key] = self.unpack(value)
+
+            return unpacked
+
+        if isinstance(obj, list):
+            return [self.unpack(value) for value in obj]
+
+        return obj
+
+
+def encode(data, level=6):
+    packer = _Packer()
+    packed = packer.pack(data)
+    raw = json.dumps({"authors": packer.authors, "data": packed}, separators=(",", ":")).encode("utf-8")
+    return MAGIC + zlib.compress(raw, level)
+
+
+def decode(raw):
+    if not raw.startswith(MAGIC):
+        raise ValueError("Not a compact backup")
+
+    payload = json.loads(zlib.decompress(raw[len(MAGIC):]))
+    return _Unpacker(payload["authors"]).unpack(payload["data"])
@@ -0,0 +1,153 @@
+import collections.abc
+import json
+import struct
+
+from .backups import SECTIONS
+
+# Layout of a container file:
+#   MAGIC
+#   JSON blobs (the guild metadata, one blob per text channel's messages, chunks of members and bans)
+#   JSON index with the offset and length of every blob
+#   8 byte offset of the index + MAGIC
+#
+# Everything except messages, members and bans lives in the metadata blob,
+# so reading the name, roles or channel tree never decodes the large sections.
+
+MAGIC = b"DBKP1\n"
+FOOTER = struct.Struct("<Q")
+CHUNK_SIZE = 1000
+
+__all__ = ("ContainerWriter", "BackupReader", "LazySection", "write_container", "dump_container")
+
+
+class ContainerWriter:
+    def __init__(self, fp):
+        self.fp = fp
+        self.meta = {key: [] for key in SECTIONS}
+        self.index = {"meta": None, "messages": {}, "members": [], "bans": []}
+        self.chunks = {"members": [], "bans": []}
+        self.fp.write(MAGIC)
+
+    def _write_blob(self, obj):
+        raw = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+        offset = self.fp.tell()
+        self.fp.write(raw)
+        return [offset, len(raw), len(obj) if isinstance(obj, list) else 1]
+
+    def _flush_chunk(self, section):
+        if len(self.chunks[section]) != 0:
+            self.index[section].append(self._write_blob(self.chunks[section]))
+            self.chunks[section] = []
+
+    def add(self, section, entry):
+        if section == "settings":
+            self.meta.update(entry)
+
+        elif section == "text_channels":
+            channel = {key: value for key, value in entry.items() if key != "messages"}
+            self.index["messages"][channel["id"]] = [self._write_blob(entry.get("messages", []))]
+            self.meta["text_channels"].append(channel)
+
+        elif section in self.chunks:
+            self.chunks[section].append(entry)
+            if len(self.chunks[section]) >= CHUNK_SIZE:
+                self._flush_chunk(section)
+
+        else:
+            self.meta[section].append(entry)
+
+    def close(self):
+        for section in self.chunks:
+            self._flush_chunk(section)
+
+        self.index["meta"] = self._write_blob(self.meta)
+        offset = self.fp.tell()
+        self.fp.write(json.dumps(self.index, separators=(",", ":")).encode("utf-8"))
+        self.fp.write(FOOTER.pack(offset) + MAGIC)
+
+
+async def write_container(fp, stream):
+    # Writes the (section, entry) pairs of BackupSaver.stream() to the binary file fp
+    writer = ContainerWriter(fp)
+    async for section, entry in stream:
+        writer.add(section, entry)
+
+    writer.close()
+
+
+def dump_container(fp, data):
+    # Writes an already loaded backup dict to the binary file fp
+    writer = ContainerWriter(fp)
+    writer.add("settings", {key: value for key, value in data.items() if key not in SECTIONS})
+    for section in SECTIONS:
+        for entry in data.get(section, []):
+            writer.add(section, entry)
+
+    writer.close()
+
+
+class LazySection(collections.abc.Sequence):
+    # A read-only list whose entries are only decoded on first access.
+    # len() is answered from the index without decoding anything.
+    def __init__(self, reader, chunks):
+        self.reader = reader
+        self.chunks = chunks
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = []
+            for offset, length, _ in self.chunks:
+                self._entries.extend(self.reader._read_blob(offset, length))
+
+        return self._entries
+
+    def __len__(self):
+        return sum(count for _, _, count in self.chunks)
+
+    def __getitem__(self, item):
+        return self._load()[item]
+
+    def __iter__(self):
+        return iter(self._load())
+
+
+class BackupReader:
+    def __init__(self, fp):
+        self.fp = fp
+        footer_offset = self.fp.seek(0, 2) - FOOTER.size - len(MAGIC)
+        self.fp.seek(footer_offset)
+        footer = self.fp.read(FOOTER.size + len(MAGIC))
+        if footer[FOOTER.size:] != MAGIC:
+            raise ValueError("Not a backup container")
+
+        index_offset, = FOOTER.unpack(footer[:FOOTER.size])
+        self.index = self._read_blob(index_offset, footer_offset - index_offset)
+        self._data = None
+
+    def _read_blob(self, offset, length):
+        self.fp.seek(offset)
+        return json.loads(self.fp.read(length))
+
+    @property
+    def data(self):
+        # The backup in the shape BackupSaver.save() returns, usable with BackupLoader and BackupInfo.
+        # Messages, members and bans are LazySections that are read from fp when accessed.
+        if self._data is None:
+            offset, length, _ = self.index["meta"]
+            self._data = self._read_blob(offset, length)
+            for channel in self._data["text_channels"]:
+                channel["messages"] = LazySection(self, self.index["messages"].get(channel["id"], []))
+
+            self._data["members"] = LazySection(self, self.index["members"])
+            self._data["bans"] = LazySection(self, self.index["bans"])
+
+        return self._data
+
+    def load(self):
+        # The whole backup as plain dicts and lists
+        data = dict(self.data)
+        data["text_channels"] = [dict(channel, messages=list(channel["messages"])) for channel in data["text_channels"]]
+        data["members"] = list(data["members"])
+        data["bans"] = list(data["bans"])
+        return data
@@ -1,151 +1,340 @@
+import asyncio
+import collections
 import discord
+import sys
 
 from . import utils
+from .metrics import Observer
+from .replay import ChatlogReplayer
+from .snapshot import capture
 
+__all__ = ("copy_guild", "copy_guild_stream", "CopyProgress")
 
-async def copy_guild(origin, target, chatlog=20):
-    ids = {}
+
+class _SilentObserver(Observer):
+    def error(self, entity, exc_info):
+        pass
+
+
+class CopyProgress:
+    def __init__(self):
+        # Origin id -> id of the copy in the target guild
+        self.ids = {}
+        # Entity -> number of copied entities, "messages" counts replayed chatlog messages
+        self.done = collections.Counter()
+        # (entity, origin id, target id) of the last completed step
+        self.last = None
+        # TeardownStats of clearing the target
+        self.teardown = None
+        self.finished = False
+
+    def __repr__(self):
+        return f"<CopyProgress finished={self.finished} {dict(self.done)}>"
+
+
+async def _copy(origin, target, chatlog, concurrency, observer, progress, changed, snapshots):
+    ids = progress.ids
+    # The roles and channels are copied from a snapshot of the origin, see SnapshotCache
+    snapshot = capture(origin) if snapshots is None else snapshots.get(origin)
+    # Failures are ignored silently unless an observer is passed
+    observer = observer or _SilentObserver()
+    replayer = ChatlogReplayer(webhook_name="sync", observer=observer)
+    http = target._state.http
+    # Origin text channel id -> future of the created channel (None if creating it failed)
+    created_channels = {channel.id: asyncio.get_event_loop().create_future() for channel in snapshot.text_channels}
+    chatlogs = asyncio.Queue(maxsize=max(concurrency, 1))
+
+    def error(entity):
+        observer.error(entity, sys.exc_info())
+
+    def completed(entity, origin_id=None, target_id=None, count=1):
+        if origin_id is not None:
+            ids[origin_id] = target_id
+
+        progress.done[entity] += count
+        progress.last = (entity, origin_id, target_id)
+        changed.set()
 
     def convert_overwrites(overwrites):
         ret = {}
-        for union, overwrite in overwrites.items():
+        for _, target_id, is_role, overwrite in overwrites:
             try:
-                if isinstance(union, discord.Role):
-                    role = target.get_role(ids.get(union.id))
+                if is_role:
+                    role = target.get_role(ids.get(target_id))
                     if role is not None:
                         ret[role] = overwrite
 
-                elif isinstance(union, discord.Member):
-                    ret[union] = overwrite
+                else:
+                    ret[discord.Object(target_id)] = overwrite
             except:
                 continue
 
         return ret
 
-    for channel in target.channels:
-        try:
-            await channel.delete()
-        except:
-            pass
-
-    for role in target.roles:
+    async def read_chatlog(channel):
         try:
-            if role.managed or role.is_default():
-                continue
-
-            await role.delete()
+            observer.api_call("text_channel", "history")
+            messages = await origin.get_channel(channel.id).history(limit=chatlog).flatten()
+            return channel, [utils.message_to_json(message) for message in reversed(messages)]
         except:
-            pass
+            error("text_channel")
+            return channel, []
 
-    for role in reversed(origin.roles):
+    async def read_chatlogs():
+        # Reads the origin chatlogs while the target is being set up, the bounded queue
+        # keeps at most `concurrency` chatlogs in memory that aren't written yet
         try:
-            if role.managed:
-                continue
-
-            if role.is_default():
-                created = target.default_role
+            async for channel, messages in utils.map_limited(read_chatlog, snapshot.text_channels, limit=concurrency):
+                await chatlogs.put((channel, messages))
+        finally:
+            for _ in range(max(concurrency, 1)):
+                await chatlogs.put(None)
 
-            else:
-                created = await target.create_role(
-                    name=role.name,
-                    hoist=role.hoist,
-                    mentionable=role.mentionable,
-                    color=role.color
-                )
+    async def write_chatlogs():
+        while True:
+            item = await chatlogs.get()
+            if item is None:
+                return
 
-            await created.edit(
-                permissions=role.permissions
-            )
-            ids[role.id] = created.id
-        except:
-            pass
+            channel, messages = item
+            created = await created_channels[channel.id]
+            if created is not None and len(messages) != 0:
+                sent, _ = await replayer.replay_channel(created, messages)
+                completed("messages", count=sent)
 
-    for category in origin.categories:
+    async def copy_category(category):
         try:
+            observer.api_call("category", "create")
             created = await target.create_category(
                 name=category.name,
                 overwrites=convert_overwrites(category.overwrites),
             )
-            ids[category.id] = created.id
+            completed("category", category.id, created.id)
         except:
-            pass
+            error("category")
 
-    for channel in origin.text_channels:
+    async def copy_text_channel(channel):
+        created = None
         try:
-            created = await target.create_text_channel(
+            created = await utils.create_channel(
+                observer,
+                "text_channel",
+                target.create_text_channel,
+                {
+                    "topic": channel.topic,
+                    "nsfw": channel.nsfw,
+                    "slowmode_delay": channel.slowmode_delay,
+                    "position": channel.position,
+                },
                 name=channel.name,
                 overwrites=convert_overwrites(channel.overwrites),
-                category=None if channel.category is None else target.get_channel(
-                    ids.get(channel.category.id))
-            )
-            await created.edit(
-                topic=channel.topic,
-                nsfw=channel.is_nsfw(),
-                slowmode_delay=channel.slowmode_delay
-            )
-            webh = await created.create_webhook(
-                name="sync"
+                category=None if channel.category is None else target.get_channel(ids.get(channel.category))
             )
-            for message in reversed(await channel.history(limit=chatlog).flatten()):
-                if message.system_content.replace(" ", "") == "" and len(message.embeds) == 0:
-                    continue
-
-                try:
-                    await webh.send(
-                        username=message.author.name,
-                        avatar_url=message.author.avatar_url,
-                        content=utils.clean_content(
-                            message.system_content) + "\n".join([attach.url for attach in message.attachments]),
-                        embeds=message.embeds
-                    )
-                except:
-                    pass
-
-            await webh.delete()
-            ids[channel.id] = created.id
+            completed("text_channel", channel.id, created.id)
         except:
-            pass
+            error("text_channel")
+        finally:
+            if not created_channels[channel.id].done():
+                created_channels[channel.id].set_result(created)
 
-    for vchannel in origin.voice_channels:
+    async def copy_voice_channel(vchannel):
         try:
-            created = await target.create_voice_channel(
+            created = await utils.create_channel(
+                observer,
+                "voice_channel",
+                target.create_voice_channel,
+                {
+                    "bitrate": vchannel.bitrate,
+                    "user_limit": vchannel.user_limit,
+                    "position": vchannel.position,
+                },
                 name=vchannel.name,
                 overwrites=convert_overwrites(vchannel.overwrites),
-                category=None if vchannel.category is None else target.get_channel(
-                    ids.get(vchannel.category.id))
-            )
-            await created.edit(
-                bitrate=vchannel.bitrate,
-                user_limit=vchannel.user_limit,
+                category=None if vchannel.category is None else target.get_channel(ids.get(vchannel.category))
             )
+            completed("voice_channel", vchannel.id, created.id)
+        except:
+            error("voice_channel")
+
+    async def copy_positions(entity, payload, update):
+        # One bulk call per type instead of an edit per entity, payload returns None if everything is in place
+        try:
+            positions = payload()
+            if positions is not None:
+                observer.api_call(entity, "positions")
+                await update(target.id, positions)
         except:
-            pass
+            error(entity)
 
-    for reason, user in await origin.bans():
+    async def copy_ban(ban):
         try:
-            await target.ban(user=user, reason=reason)
+            observer.api_call("ban", "create")
+            await target.ban(user=discord.Object(int(ban["user"]["id"])), reason=ban["reason"])
+            completed("ban")
         except:
-            pass
+            error("ban")
 
-    for tmember in target.members:
-        omember = origin.get_member(tmember.id)
-        if omember is None:
-            continue
+    async def copy_bans():
+        # The origin ban list is read page by page, users that are banned in the target already are skipped
+        with observer.phase("copy_bans"):
+            try:
+                banned = await utils.banned_ids(http, target.id, observer)
+                async for page in utils.ban_pages(origin._state.http, origin.id, observer):
+                    await utils.gather_limited(
+                        [copy_ban(ban) for ban in page if int(ban["user"]["id"]) not in banned],
+                        limit=concurrency
+                    )
+            except:
+                error("ban")
 
+    async def copy_member(tmember, roles):
         try:
-            await tmember.add_roles(*[discord.Object(ids.get(role.id)) for role in omember.roles if role.id in ids and not role.is_default()])
+            observer.api_call("member", "add_roles")
+            await tmember.add_roles(*roles)
+            completed("member")
         except:
-            pass
-
-    await target.edit(
-        name=origin.name,
-        region=origin.region,
-        afk_channel=None if origin.afk_channel is None else target.get_channel(
-            ids.get(origin.afk_channel.id)),
-        afk_timeout=origin.afk_timeout,
-        verification_level=origin.verification_level,
-        system_channel=None if origin.system_channel is None else target.get_channel(
-            ids.get(origin.system_channel.id)),
-    )
-
-    return ids
+            error("member")
+
+    async def copy_members():
+        with observer.phase("copy_members"):
+            # Only the roles the member doesn't have yet, members that have all of them are skipped
+            edits = []
+            for tmember in target.members:
+                omember = origin.get_member(tmember.id)
+                if omember is None:
+                    continue
+
+                current_roles = {role.id for role in tmember.roles}
+                roles = [
+                    discord.Object(ids[role.id]) for role in omember.roles
+                    if role.id in ids and not role.is_default() and ids[role.id] not in current_roles
+                ]
+                if len(roles) != 0:
+                    edits.append(copy_member(tmember, roles))
+
+            await utils.gather_limited(edits, limit=concurrency)
+
+    tasks = []
+    try:
+        if chatlog != 0:
+            tasks.append(asyncio.ensure_future(read_chatlogs()))
+            tasks.extend(asyncio.ensure_future(write_chatlogs()) for _ in range(max(concurrency, 1)))
+
+        with observer.phase("copy_teardown"):
+            progress.teardown = await utils.teardown(
+                [("channel", channel) for channel in target.channels]
+                + [("role", role) for role in target.roles if not role.managed and not role.is_default()],
+                observer,
+                limit=concurrency
+            )
+            changed.set()
+
+        # Bans don't depend on anything in the target, they are copied while everything else is set up
+        tasks.append(asyncio.ensure_future(copy_bans()))
+
+        with observer.phase("copy_roles"):
+            # Sequential, the creation order defines the hierarchy
+            for role in reversed(snapshot.roles):
+                try:
+                    if role.managed:
+                        continue
+
+                    if role.default:
+                        created = target.default_role
+
+                    else:
+                        observer.api_call("role", "create")
+                        created = await target.create_role(
+                            name=role.name,
+                            hoist=role.hoist,
+                            mentionable=role.mentionable,
+                            color=discord.Colour(role.color)
+                        )
+
+                    observer.api_call("role", "edit")
+                    await created.edit(
+                        permissions=discord.Permissions(role.permissions)
+                    )
+                    completed("role", role.id, created.id)
+                except:
+                    error("role")
+
+            roles = [role for role in snapshot.roles if role.id in ids and not role.default]
+            await copy_positions("role", lambda: utils.role_position_updates(target, [ids[role.id] for role in roles]),
+                                 http.move_role_position)
+
+        tasks.append(asyncio.ensure_future(copy_members()))
+
+        with observer.phase("copy_categories"):
+            await utils.gather_limited([copy_category(category) for category in snapshot.categories], limit=concurrency)
+
+        with observer.phase("copy_channels"):
+            semaphore = asyncio.Semaphore(max(concurrency, 1))
+            await asyncio.gather(
+                utils.gather_limited([copy_text_channel(channel) for channel in snapshot.text_channels],
+                                     semaphore=semaphore),
+                utils.gather_limited([copy_voice_channel(vchannel) for vchannel in snapshot.voice_channels],
+                                     semaphore=semaphore),
+            )
+            await copy_positions("channel", lambda: utils.position_updates([
+                (ids[channel.id], getattr(target.get_channel(ids[channel.id]), "position", None), channel.position)
+                for channel in snapshot.channels if channel.id in ids
+            ]), http.bulk_channel_update)
+
+        with observer.phase("copy_settings"):
+            observer.api_call("guild", "edit")
+            await target.edit(
+                name=origin.name,
+                region=origin.region,
+                afk_channel=None if origin.afk_channel is None else target.get_channel(
+                    ids.get(origin.afk_channel.id)),
+                afk_timeout=origin.afk_timeout,
+                verification_level=origin.verification_level,
+                system_channel=None if origin.system_channel is None else target.get_channel(
+                    ids.get(origin.system_channel.id)),
+            )
+
+        with observer.phase("copy_chatlogs"):
+            await asyncio.gather(*tasks)
+    finally:
+        for future in created_channels.values():
+            if not future.done():
+                future.set_result(None)
+
+        for task in tasks:
+            task.cancel()
+
+        if snapshots is not None:
+            snapshots.invalidate(target.id)
+
+
+async def copy_guild_stream(origin, target, chatlog=20, concurrency=1, observer=None, snapshots=None):
+    # Copies origin into target and yields a CopyProgress every time something was copied.
+    # Origin reads and target writes overlap, up to `concurrency` channels are copied at once.
+    # Several steps can be completed between two yields, the same object is yielded every time.
+    # With a SnapshotCache passed as snapshots, a cached snapshot of the origin is reused.
+    progress = CopyProgress()
+    changed = asyncio.Event()
+    task = asyncio.ensure_future(_copy(origin, target, chatlog, concurrency, observer, progress, changed, snapshots))
+    try:
+        while not task.done():
+            waiter = asyncio.ensure_future(changed.wait())
+            await asyncio.wait([task, waiter], return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            changed.clear()
+            if not task.done():
+                yield progress
+
+        task.result()
+        progress.finished = True
+        yield progress
+    finally:
+        task.cancel()
+
+
+async def copy_guild(origin, target, chatlog=20, concurrency=1, observer=None, snapshots=None):
+    progress = None
+    async for progress in copy_guild_stream(origin, target, chatlog, concurrency, observer, snapshots):
+        pass
+
+    return progress.ids
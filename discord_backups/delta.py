@@ -0,0 +1,101 @@
+# Deltas between two backups of the same guild.
+#
+# A delta only contains the top level values that changed, the entries of each section that
+# were added or changed (matched by id), the new order of a section if it differs and the
+# messages that are not part of the base yet. Edits and deletions of already stored messages
+# are not tracked.
+
+KEYS = {
+    "text_channels": "id",
+    "voice_channels": "id",
+    "categories": "id",
+    "roles": "id",
+    "members": "id",
+    "bans": "user",
+}
+
+
+def _without_messages(channel):
+    return {key: value for key, value in channel.items() if key != "messages"}
+
+
+def diff(base, new, chatlog=20):
+    changes = {
+        "delta": True,
+        "chatlog": chatlog,
+        "settings": {
+            key: value for key, value in new.items()
+            if key not in KEYS and base.get(key) != value
+        },
+        "sections": {},
+        "messages": {},
+    }
+
+    for section, key in KEYS.items():
+        old_entries = {entry[key]: entry for entry in base.get(section, [])}
+        order = [entry[key] for entry in new.get(section, [])]
+        changed = []
+        for entry in new.get(section, []):
+            old = old_entries.get(entry[key])
+            if section == "text_channels":
+                entry = _without_messages(entry)
+                old = None if old is None else _without_messages(old)
+
+            if old != entry:
+                changed.append(entry)
+
+        section_changes = {}
+        if len(changed) != 0:
+            section_changes["changed"] = changed
+
+        if order != [entry[key] for entry in base.get(section, [])]:
+            section_changes["order"] = order
+
+        if len(section_changes) != 0:
+            changes["sections"][section] = section_changes
+
+    base_channels = {channel["id"]: channel for channel in base.get("text_channels", [])}
+    for channel in new.get("text_channels", []):
+        base_channel = base_channels.get(channel["id"])
+        known = set() if base_channel is None else {message["id"] for message in base_channel["messages"]}
+        added = [message for message in channel["messages"] if message["id"] not in known]
+        if len(added) != 0:
+            changes["messages"][channel["id"]] = added
+
+    return changes
+
+
+def _apply(base, changes):
+    data = {key: value for key, value in base.items() if key not in KEYS}
+    data.update(changes["settings"])
+
+    for section, key in KEYS.items():
+        section_changes = changes["sections"].get(section, {})
+        entries = {entry[key]: entry for entry in base.get(section, [])}
+        order = section_changes.get("order", list(entries.keys()))
+        for entry in section_changes.get("changed", []):
+            if section == "text_channels":
+                old = entries.get(entry[key])
+                entry = dict(entry, messages=[] if old is None else old["messages"])
+
+            entries[entry[key]] = entry
+
+        data[section] = [entries[entry_id] for entry_id in order]
+
+    chatlog = changes["chatlog"]
+    for index, channel in enumerate(data["text_channels"]):
+        added = changes["messages"].get(channel["id"])
+        if added is not None:
+            messages = list(channel["messages"]) + added
+            data["text_channels"][index] = dict(channel, messages=messages[-chatlog:] if chatlog else [])
+
+    return data
+
+
+def apply(base, *deltas):
+    # Materializes the full backup from a base backup and the deltas created after it, in order
+    data = base
+    for changes in deltas:
+        data = _apply(data, changes)
+
+    return data
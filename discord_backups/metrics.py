@@ -0,0 +1,154 @@
+import collections
+import contextlib
+import logging
+import time
+import traceback
+
+__all__ = ("Observer", "MetricsRecorder")
+
+
+class Observer:
+    # Receives events from BackupSaver, BackupLoader, ChatlogReplayer and copy_guild.
+    # All methods are no-ops except error, which prints the traceback like the library always did.
+    # Subclass it and override what you need, the methods are called inline and should be cheap.
+
+    def phase_started(self, phase):
+        pass
+
+    def phase_finished(self, phase, duration):
+        pass
+
+    def api_call(self, entity, action):
+        # An API request is about to be made, e.g. ("role", "create")
+        pass
+
+    def retry(self, entity, action, attempt):
+        pass
+
+    def rate_limited(self, bucket, wait):
+        # A request has to wait `wait` seconds for the rate limit of `bucket`
+        pass
+
+    def error(self, entity, exc_info):
+        traceback.print_exception(*exc_info)
+
+    def guild_error(self, guild_id, entity, exc_info):
+        # An error while saving one guild of a BackupBatch
+        self.error(entity, exc_info)
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        self.phase_started(phase)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_finished(phase, time.perf_counter() - start)
+
+    def attach(self, logger="discord.http"):
+        # Reports the rate limits discord.py's HTTP client runs into, by listening to its log messages.
+        # The exhausted bucket messages are DEBUG records, the logger is lowered to DEBUG while observers
+        # are attached and records below its former level are dropped again after the observers saw them.
+        log = logging.getLogger(logger)
+        handler = next((f for f in log.filters if isinstance(f, _RateLimitFilter)), None)
+        if handler is None:
+            handler = _RateLimitFilter(log.getEffectiveLevel(), log.level)
+            log.addFilter(handler)
+            if handler.level > logging.DEBUG:
+                log.setLevel(logging.DEBUG)
+
+        handler.observers.append(self)
+        return handler
+
+    def detach(self, handler, logger="discord.http"):
+        if self in handler.observers:
+            handler.observers.remove(self)
+
+        if len(handler.observers) == 0:
+            log = logging.getLogger(logger)
+            log.removeFilter(handler)
+            log.setLevel(handler.previous)
+
+
+class _RateLimitFilter(logging.Filter):
+    # One per logger, shared by all attached observers
+    def __init__(self, level, previous):
+        super().__init__()
+        self.observers = []
+        # Effective level of the logger before the observers were attached, and the level it was set to
+        self.level = level
+        self.previous = previous
+
+    def filter(self, record):
+        rate_limit = None
+        msg = str(record.msg)
+        if msg.startswith("We are being rate limited."):
+            retry_after, bucket = record.args
+            rate_limit = bucket, retry_after
+
+        elif msg.startswith("A rate limit bucket has been exhausted"):
+            rate_limit = record.args
+
+        if rate_limit is not None:
+            for observer in self.observers:
+                observer.rate_limited(*rate_limit)
+
+        return record.levelno >= self.level
+
+
+class MetricsRecorder(Observer):
+    # Collects everything it receives, summary() returns it as a dict.
+    # Errors are recorded instead of printed unless print_errors is set.
+
+    def __init__(self, print_errors=False):
+        self.print_errors = print_errors
+        self.phases = collections.defaultdict(float)
+        self.calls = collections.Counter()
+        self.retries = collections.Counter()
+        self.rate_limits = 0
+        self.rate_limit_wait = 0
+        self.errors = []
+        self._started = {}
+
+    def phase_started(self, phase):
+        self._started[phase] = time.perf_counter()
+
+    def phase_finished(self, phase, duration):
+        self._started.pop(phase, None)
+        self.phases[phase] += duration
+
+    def api_call(self, entity, action):
+        self.calls[(entity, action)] += 1
+
+    def retry(self, entity, action, attempt):
+        self.retries[(entity, action)] += 1
+
+    def rate_limited(self, bucket, wait):
+        self.rate_limits += 1
+        self.rate_limit_wait += wait
+
+    def error(self, entity, exc_info):
+        self.guild_error(None, entity, exc_info)
+
+    def guild_error(self, guild_id, entity, exc_info):
+        exc_type, exc, _ = exc_info
+        self.errors.append({
+            "entity": entity,
+            "guild": None if guild_id is None else str(guild_id),
+            "type": exc_type.__name__,
+            "message": str(exc),
+            "status": getattr(exc, "status", None),
+        })
+        if self.print_errors:
+            super().error(entity, exc_info)
+
+    def summary(self):
+        return {
+            "phases": dict(self.phases),
+            "calls": {f"{entity}.{action}": count for (entity, action), count in self.calls.items()},
+            "total_calls": sum(self.calls.values()),
+            "retries": {f"{entity}.{action}": count for (entity, action), count in self.retries.items()},
+            "rate_limits": self.rate_limits,
+            "rate_limit_wait": self.rate_limit_wait,
+            "errors": list(self.errors),
+        }
@@ -0,0 +1,300 @@
+import collections
+import discord
+
+from . import utils
+from .backups import BackupLoader
+
+__all__ = ("BackupReconciler", "Plan", "Action")
+
+
+class Action:
+    __slots__ = ("kind", "entity", "data", "target", "changes", "calls")
+
+    def __init__(self, kind, entity, data=None, target=None, changes=(), calls=1):
+        # kind is one of "create", "edit" and "delete", entity one of "role", "category", "text_channel"
+        # and "voice_channel". data is the backup entry, target the existing discord object.
+        self.kind = kind
+        self.entity = entity
+        self.data = data
+        self.target = target
+        self.changes = tuple(changes)
+        self.calls = calls
+
+    def __repr__(self):
+        name = self.data["name"] if self.data is not None else self.target.name
+        return f"<Action {self.kind} {self.entity} {name!r} {', '.join(self.changes)}>"
+
+
+class Plan:
+    def __init__(self):
+        self.actions = []
+        # Backup id -> existing discord object that is kept
+        self.matches = {}
+
+    def add(self, action):
+        self.actions.append(action)
+
+    @property
+    def calls(self):
+        return sum(action.calls for action in self.actions)
+
+    def summary(self):
+        return collections.Counter((action.kind, action.entity) for action in self.actions)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.actions)
+
+
+class BackupReconciler(BackupLoader):
+    # Loads a backup by comparing it with the current state of the guild, only creating, editing and
+    # deleting the roles and channels that differ instead of deleting and recreating everything.
+    # Existing entities are matched by id first (restoring onto the guild the backup was made from)
+    # and by name second.
+
+    def __init__(self, bot, session, data, observer=None):
+        super().__init__(bot, session, data, observer)
+        self.plan = Plan()
+
+    def _match(self, entries, existing):
+        by_id = {str(obj.id): obj for obj in existing}
+        by_name = collections.defaultdict(list)
+        for obj in existing:
+            by_name[obj.name].append(obj)
+
+        matches = {}
+        used = set()
+        for entry in entries:
+            obj = by_id.get(entry["id"])
+            if obj is None or obj.id in used:
+                obj = next((o for o in by_name[entry["name"]] if o.id not in used), None)
+
+            if obj is not None:
+                used.add(obj.id)
+                matches[entry["id"]] = obj
+
+        return matches
+
+    def _translated(self, backup_id):
+        obj = self.plan.matches.get(backup_id)
+        return None if obj is None else obj.id
+
+    def _overwrites_changed(self, data, channel):
+        # Targets discord.py can't resolve (e.g. members that left) are None
+        current = {
+            str(target.id): overwrite._values
+            for target, overwrite in channel.overwrites.items()
+            if target is not None
+        }
+        wanted = {}
+        for union_id, overwrite in data["overwrites"].items():
+            target = self._translated(union_id)
+            if target is None:
+                if union_id in self._backup_roles:
+                    # A role that still has to be created
+                    return True
+
+                if self.guild.get_member(int(union_id)) is None:
+                    # A member that isn't in the guild, the loader skips these as well
+                    continue
+
+                target = int(union_id)
+
+            wanted[str(target)] = overwrite
+
+        return current != wanted
+
+    def _category_changed(self, data, channel):
+        current = None if channel.category is None else channel.category.id
+        wanted = None if data["category"] is None else self._translated(data["category"])
+        return current != wanted or (data["category"] is not None and wanted is None)
+
+    def _plan_roles(self):
+        roles = [role for role in self.data["roles"] if not role["default"]]
+        existing = [role for role in self.guild.roles if not role.managed and not role.is_default()]
+        matches = self._match(roles, existing)
+        self.plan.matches.update(matches)
+
+        for role in reversed(self.data["roles"]):
+            if role["default"]:
+                self.plan.matches[role["id"]] = self.guild.default_role
+                if self.guild.default_role.permissions.value != role["permissions"]:
+                    self.plan.add(Action("edit", "role", role, self.guild.default_role, ["permissions"]))
+
+                continue
+
+            obj = matches.get(role["id"])
+            if obj is None:
+                self.plan.add(Action("create", "role", role))
+                continue
+
+            changes = [
+                key for key, value in (
+                    ("name", obj.name),
+                    ("permissions", obj.permissions.value),
+                    ("color", obj.color.value),
+                    ("hoist", obj.hoist),
+                    ("mentionable", obj.mentionable),
+                )
+                if role[key] != value
+            ]
+            if len(changes) != 0:
+                self.plan.add(Action("edit", "role", role, obj, changes))
+
+        matched = {obj.id for obj in matches.values()}
+        for obj in existing:
+            if obj.id not in matched:
+                self.plan.add(Action("delete", "role", target=obj))
+
+    def _plan_channels(self):
+        types = [
+            ("category", self.data["categories"], self.guild.categories, ()),
+            ("text_channel", self.data["text_channels"], self.guild.text_channels,
+             (("topic", lambda c: c.topic), ("nsfw", lambda c: c.is_nsfw()),
+              ("slowmode_delay", lambda c: c.slowmode_delay))),
+            ("voice_channel", self.data["voice_channels"], self.guild.voice_channels,
+             (("bitrate", lambda c: c.bitrate), ("user_limit", lambda c: c.user_limit))),
+        ]
+
+        for entity, entries, existing, attributes in types:
+            matches = self._match(entries, existing)
+            self.plan.matches.update(matches)
+
+            for data in entries:
+                obj = matches.get(data["id"])
+                if obj is None:
+                    self.plan.add(Action("create", entity, data))
+                    continue
+
+                changes = [key for key, getter in attributes if data.get(key) != getter(obj)]
+                if data["name"] != obj.name:
+                    changes.append("name")
+
+                if entity != "category" and self._category_changed(data, obj):
+                    changes.append("category")
+
+                if self._overwrites_changed(data, obj):
+                    changes.append("overwrites")
+
+                if len(changes) != 0:
+                    self.plan.add(Action("edit", entity, data, obj, changes))
+
+            matched = {obj.id for obj in matches.values()}
+            for obj in existing:
+                if obj.id not in matched:
+                    self.plan.add(Action("delete", entity, target=obj))
+
+    def make_plan(self):
+        self.plan = Plan()
+        self._backup_roles = {role["id"] for role in self.data["roles"]}
+        if self.options.get("roles"):
+            self._plan_roles()
+
+        if self.options.get("channels"):
+            self._plan_channels()
+
+        return self.plan
+
+    def _actions(self, kind, entity):
+        return {action.data["id"]: action for action in self.plan if action.kind == kind and action.entity == entity}
+
+    def _overwrites_payload(self, json):
+        # GuildChannel.edit of discord.py 1.2 silently drops an overwrites argument,
+        # the overwrites are passed on as the raw permission_overwrites of the API instead
+        payload = []
+        for target, overwrite in self._overwrites_from_json(json).items():
+            allow, deny = overwrite.pair()
+            payload.append({
+                "id": target.id,
+                "type": "role" if isinstance(target, discord.Role) else "member",
+                "allow": allow.value,
+                "deny": deny.value,
+            })
+
+        return payload
+
+    async def _apply_edit(self, action, **fields):
+        try:
+            if "overwrites" in action.changes:
+                fields["permission_overwrites"] = self._overwrites_payload(action.data["overwrites"])
+
+            if "category" in action.changes:
+                fields["category"] = self.guild.get_channel(self.id_translator.get(action.data["category"]))
+
+            for key in action.changes:
+                if key in action.data and key not in fields and key != "overwrites":
+                    fields[key] = action.data[key]
+
+            self.observer.api_call(action.entity, "edit")
+            await action.target.edit(reason=self.reason, **fields)
+        except:
+            self._error(action.entity)
+
+    async def _prepare_guild(self):
+        deletes = [(action.entity, action.target) for action in self.plan if action.kind == "delete"]
+        with self.observer.phase("prepare_guild"):
+            self.teardown_stats = await utils.teardown(deletes, self.observer, self.reason, semaphore=self.semaphore)
+
+    async def _load_role(self, role):
+        obj = self.plan.matches.get(role["id"])
+        if obj is None:
+            return await super()._load_role(role)
+
+        action = self._edits["role"].get(role["id"])
+        if action is not None:
+            fields = {}
+            if "permissions" in action.changes:
+                fields["permissions"] = discord.Permissions(role["permissions"])
+
+            if "color" in action.changes:
+                fields["color"] = discord.Color(role["color"])
+
+            await self._apply_edit(action, **fields)
+
+        self.id_translator[role["id"]] = obj.id
+
+    async def _load_matched(self, entity, data):
+        obj = self.plan.matches[data["id"]]
+        action = self._edits[entity].get(data["id"])
+        if action is not None:
+            await self._apply_edit(action)
+
+        self.id_translator[data["id"]] = obj.id
+
+    async def _load_category(self, category):
+        if category["id"] not in self.plan.matches:
+            return await super()._load_category(category)
+
+        await self._load_matched("category", category)
+
+    async def _load_text_channel(self, tchannel):
+        if tchannel["id"] not in self.plan.matches:
+            return await super()._load_text_channel(tchannel)
+
+        await self._load_matched("text_channel", tchannel)
+
+    async def _load_voice_channel(self, vchannel):
+        if vchannel["id"] not in self.plan.matches:
+            return await super()._load_voice_channel(vchannel)
+
+        await self._load_matched("voice_channel", vchannel)
+
+    async def load(self, guild, loader: discord.User, chatlog, concurrency=1, dry_run=False, checkpoint=None,
+                   job_id=None, **options):
+        # Returns the Plan. With dry_run=True nothing is changed, plan.calls is the number of
+        # API calls that executing it would take (without chatlog messages and the bulk position updates).
+        self.guild = guild
+        if len(options) != 0:
+            self.options = options
+
+        self.make_plan()
+        self._edits = {
+            entity: self._actions("edit", entity)
+            for entity in ("role", "category", "text_channel", "voice_channel")
+        }
+        if not dry_run:
+            await super().load(guild, loader, chatlog, concurrency, checkpoint, job_id, **options)
+
+        return self.plan
@@ -0,0 +1,191 @@
+import asyncio
+import discord
+import sys
+import time
+
+from . import utils
+from .metrics import Observer
+
+# Limits of a single webhook message
+MAX_CONTENT = 2000
+MAX_EMBEDS = 10
+# Attachments that are shown as image embeds, other files are linked in the content
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+
+__all__ = ("ChatlogReplayer", "ReplayStats")
+
+
+class ReplayStats:
+    def __init__(self):
+        self.channels = 0
+        self.messages = 0
+        self.posts = 0
+        self.failed = 0
+        self.duration = 0
+
+    @property
+    def messages_per_second(self):
+        return self.messages / self.duration if self.duration else 0
+
+    def __repr__(self):
+        return (f"<ReplayStats channels={self.channels} messages={self.messages} posts={self.posts} "
+                f"failed={self.failed} duration={self.duration:.2f}s>")
+
+
+def _is_image(url):
+    return url.split("?", 1)[0].lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _message_parts(message):
+    content = utils.clean_content(message["content"] or "")
+    embeds = [discord.Embed.from_dict(embed) for embed in message["embeds"]]
+    files = []
+    for attachment in message["attachments"]:
+        if _is_image(attachment):
+            emb = discord.Embed()
+            emb.set_image(url=attachment)
+            embeds.append(emb)
+        else:
+            files.append(attachment)
+
+    if len(files) != 0:
+        content = "\n".join([content] + files if content else files)
+
+    return content, embeds
+
+
+def _pieces(content, embeds):
+    # Splits a message that doesn't fit into one webhook message into several
+    count = max(-(-len(content) // MAX_CONTENT), -(-len(embeds) // MAX_EMBEDS), 1)
+    return [
+        (content[i * MAX_CONTENT:(i + 1) * MAX_CONTENT], embeds[i * MAX_EMBEDS:(i + 1) * MAX_EMBEDS])
+        for i in range(count)
+    ]
+
+
+def coalesce(messages):
+    # Merges consecutive messages of the same author into one post as long as the
+    # result stays within the limits of a webhook message.
+    # Yields (post, number of merged messages), posts are dicts of webhook.send kwargs.
+    post = None
+    author = None
+    merged = 0
+    for message in messages:
+        content, embeds = _message_parts(message)
+        if content.replace(" ", "") == "" and len(embeds) == 0:
+            continue
+
+        fits = (
+            post is not None
+            and message["author"]["id"] == author
+            and len(post["content"]) + len(content) + 1 <= MAX_CONTENT
+            and len(post["embeds"]) + len(embeds) <= MAX_EMBEDS
+        )
+        if fits:
+            if content:
+                post["content"] = post["content"] + "\n" + content if post["content"] else content
+
+            post["embeds"].extend(embeds)
+            merged += 1
+            continue
+
+        if post is not None:
+            yield post, merged
+
+        # A message that is too large for one post continues in posts of its own,
+        # the message is counted with the first one
+        author = message["author"]["id"]
+        pieces = _pieces(content, embeds)
+        for index, (content, embeds) in enumerate(pieces):
+            merged = 1 if index == 0 else 0
+            post = {
+                "username": message["author"]["name"],
+                "avatar_url": message["author"]["avatar_url"],
+                "content": content,
+                "embeds": embeds,
+            }
+            if index != len(pieces) - 1:
+                yield post, merged
+
+    if post is not None:
+        yield post, merged
+
+
+class ChatlogReplayer:
+    # Posts saved messages into channels through webhooks. Messages of one channel are sent
+    # in order, different channels are replayed concurrently (up to `concurrency` at once).
+    # Rate limits of the webhooks are handled by discord.py.
+
+    def __init__(self, concurrency=1, webhook_name="chatlog", observer=None):
+        self.concurrency = concurrency
+        self.webhook_name = webhook_name
+        self.observer = observer or Observer()
+        self.stats = ReplayStats()
+
+    async def _replay(self, webhook, messages):
+        # Returns the number of messages that were sent and the number of messages that failed
+        sent = failed = 0
+        for post, merged in coalesce(messages):
+            try:
+                self.observer.api_call("webhook", "send")
+                await webhook.send(**{key: value for key, value in post.items() if value or key == "username"})
+                self.stats.posts += 1
+                self.stats.messages += merged
+                sent += merged
+            except asyncio.CancelledError:
+                raise
+            except:
+                # Continuation posts of a split message count as a failed message too
+                self.stats.failed += merged
+                failed += max(merged, 1)
+                self.observer.error("message", sys.exc_info())
+
+        return sent, failed
+
+    async def replay(self, webhook, messages):
+        # Returns the number of messages that were sent
+        sent, _ = await self._replay(webhook, messages)
+        return sent
+
+    async def replay_channel(self, channel, messages):
+        # Creates a temporary webhook in channel, replays the messages and deletes the webhook again.
+        # Returns the number of messages that were sent and whether all of them were sent.
+        # A cancelled replay raises CancelledError.
+        sent = 0
+        complete = False
+        try:
+            self.observer.api_call("webhook", "create")
+            webh = await channel.create_webhook(name=self.webhook_name)
+            try:
+                sent, failed = await self._replay(webh, messages)
+            finally:
+                self.observer.api_call("webhook", "delete")
+                await webh.delete()
+
+            self.stats.channels += 1
+            complete = failed == 0
+        except asyncio.CancelledError:
+            raise
+        except:
+            self.observer.error("webhook", sys.exc_info())
+
+        return sent, complete
+
+    async def replay_all(self, jobs, done=None):
+        # jobs is an iterable of (channel, messages), done is called with each channel whose messages
+        # were all sent. Failed and cancelled channels aren't passed to done.
+        async def _replay(channel, messages):
+            _, complete = await self.replay_channel(channel, messages)
+            if complete and done is not None:
+                done(channel)
+
+        start = time.perf_counter()
+        try:
+            await utils.gather_limited(
+                [_replay(channel, messages) for channel, messages in jobs],
+                limit=self.concurrency
+            )
+        finally:
+            self.stats.duration += time.perf_counter() - start
+
+        return self.stats
@@ -0,0 +1,161 @@
+import collections
+import discord
+import time
+
+__all__ = ("GuildSnapshot", "RoleSnapshot", "ChannelSnapshot", "SnapshotCache", "capture")
+
+# Gateway events that change the structure of a guild, with a function returning the guild id from their arguments
+EVENTS = {
+    "on_guild_update": lambda before, after: after.id,
+    "on_guild_remove": lambda guild: guild.id,
+    "on_guild_available": lambda guild: guild.id,
+    "on_guild_unavailable": lambda guild: guild.id,
+    "on_guild_role_create": lambda role: role.guild.id,
+    "on_guild_role_delete": lambda role: role.guild.id,
+    "on_guild_role_update": lambda before, after: after.guild.id,
+    "on_guild_channel_create": lambda channel: channel.guild.id,
+    "on_guild_channel_delete": lambda channel: channel.guild.id,
+    "on_guild_channel_update": lambda before, after: after.guild.id,
+}
+
+
+class RoleSnapshot:
+    __slots__ = ("id", "key", "name", "permissions", "color", "hoist", "position", "mentionable", "managed",
+                 "default")
+
+    def __init__(self, role):
+        self.id = role.id
+        self.key = str(role.id)
+        self.name = role.name
+        self.permissions = role.permissions.value
+        self.color = role.color.value
+        self.hoist = role.hoist
+        self.position = role.position
+        self.mentionable = role.mentionable
+        self.managed = role.managed
+        self.default = role.is_default()
+
+    def __repr__(self):
+        return f"<RoleSnapshot id={self.id} name={self.name!r}>"
+
+
+class ChannelSnapshot:
+    # Categories, text and voice channels. Attributes that don't exist for the kind of channel are None.
+    # overwrites is a tuple of (target id as str, target id, target is a role, PermissionOverwrite).
+    __slots__ = ("id", "key", "kind", "name", "position", "category", "category_key", "overwrites", "topic",
+                 "slowmode_delay", "nsfw", "bitrate", "user_limit")
+
+    def __init__(self, channel, kind):
+        self.id = channel.id
+        self.key = str(channel.id)
+        self.kind = kind
+        self.name = channel.name
+        self.position = channel.position
+        category = getattr(channel, "category", None)
+        self.category = None if category is None else category.id
+        self.category_key = None if category is None else str(category.id)
+        try:
+            self.overwrites = tuple(
+                (str(target.id), target.id, isinstance(target, discord.Role), overwrite)
+                for target, overwrite in channel.overwrites.items()
+            )
+        except:
+            self.overwrites = ()
+
+        self.topic = getattr(channel, "topic", None)
+        self.slowmode_delay = getattr(channel, "slowmode_delay", None)
+        self.nsfw = channel.is_nsfw() if kind == "text" else None
+        self.bitrate = getattr(channel, "bitrate", None)
+        self.user_limit = getattr(channel, "user_limit", None)
+
+    def overwrites_json(self):
+        return {key: dict(overwrite._values) for key, _, _, overwrite in self.overwrites}
+
+    def __repr__(self):
+        return f"<ChannelSnapshot {self.kind} id={self.id} name={self.name!r}>"
+
+
+class GuildSnapshot:
+    # The roles and channels of a guild at one point in time, in the order of guild.roles,
+    # guild.categories, guild.text_channels and guild.voice_channels.
+    # Members, bans, messages and the settings change too often to be cached, read them from the guild.
+    __slots__ = ("id", "created", "roles", "categories", "text_channels", "voice_channels")
+
+    def __init__(self, guild):
+        self.id = guild.id
+        self.created = time.monotonic()
+        self.roles = tuple(RoleSnapshot(role) for role in guild.roles)
+        self.categories = tuple(ChannelSnapshot(category, "category") for category in guild.categories)
+        self.text_channels = tuple(ChannelSnapshot(channel, "text") for channel in guild.text_channels)
+        self.voice_channels = tuple(ChannelSnapshot(channel, "voice") for channel in guild.voice_channels)
+
+    @property
+    def channels(self):
+        return self.categories + self.text_channels + self.voice_channels
+
+    def __repr__(self):
+        return (f"<GuildSnapshot id={self.id} roles={len(self.roles)} categories={len(self.categories)} "
+                f"text_channels={len(self.text_channels)} voice_channels={len(self.voice_channels)}>")
+
+
+def capture(guild):
+    return GuildSnapshot(guild)
+
+
+class SnapshotCache:
+    # Keeps the GuildSnapshot of recently saved or copied guilds, so back to back backups don't walk the
+    # guild objects again. Snapshots expire after `ttl` seconds, the least recently used ones are evicted
+    # above `max_size` guilds. attach(bot) drops the snapshot of a guild when the gateway reports a change.
+    # Pass it to BackupSaver (saver.snapshots), BackupBatch or copy_guild.
+
+    def __init__(self, ttl=60, max_size=128):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._snapshots = collections.OrderedDict()
+        self._listeners = {}
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def __contains__(self, guild_id):
+        return guild_id in self._snapshots
+
+    def get(self, guild):
+        # The cached snapshot of the guild, captured again if there is none or it expired
+        snapshot = self._snapshots.get(guild.id)
+        if snapshot is not None and time.monotonic() - snapshot.created < self.ttl:
+            self._snapshots.move_to_end(guild.id)
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        snapshot = capture(guild)
+        self._snapshots[guild.id] = snapshot
+        self._snapshots.move_to_end(guild.id)
+        while len(self._snapshots) > self.max_size:
+            self._snapshots.popitem(last=False)
+
+        return snapshot
+
+    def invalidate(self, guild_id):
+        self._snapshots.pop(guild_id, None)
+
+    def clear(self):
+        self._snapshots.clear()
+
+    def attach(self, bot):
+        # Registers a listener for every event in EVENTS, bot needs add_listener (discord.ext.commands.Bot)
+        for event, guild_id in EVENTS.items():
+            async def listener(*args, _guild_id=guild_id):
+                self.invalidate(_guild_id(*args))
+
+            self._listeners[event] = listener
+            bot.add_listener(listener, event)
+
+    def detach(self, bot):
+        for event, listener in self._listeners.items():
+            bot.remove_listener(listener, event)
+
+        self._listeners = {}
@@ -1,4 +1,178 @@
+import asyncio
+import collections
+import discord
+import itertools
+import sys
+import time
+
+from discord.http import Route
+
+# Bans per page of the ban list, the maximum Discord allows
+BAN_PAGE_SIZE = 1000
+
+
 def clean_content(content):
     content = content.replace("@everyone", "@\u200beveryone")
     content = content.replace("@here", "@\u200bhere")
     return content
+
+
+def message_to_json(message):
+    return {
+        "id": str(message.id),
+        "content": message.system_content,
+        "author": {
+            "id": str(message.author.id),
+            "name": message.author.name,
+            "discriminator": message.author.discriminator,
+            "avatar_url": str(message.author.avatar_url)
+        },
+        "pinned": message.pinned,
+        "attachments": [attach.url for attach in message.attachments],
+        "embeds": [embed.to_dict() for embed in message.embeds],
+        "reactions": [
+            str(reaction.emoji.name)
+            if isinstance(reaction.emoji, discord.Emoji) else str(reaction.emoji)
+            for reaction in message.reactions
+        ],
+    }
+
+
+async def gather_limited(coros, limit=1, semaphore=None):
+    # Like asyncio.gather, but at most `limit` of the coroutines run at the same time.
+    # A shared `semaphore` can be passed to apply one limit across several calls.
+    # Results keep the order of `coros`.
+    semaphore = semaphore or asyncio.Semaphore(max(limit, 1))
+
+    async def _run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[_run(coro) for coro in coros])
+
+
+async def map_limited(func, items, limit=1):
+    # Async generator yielding `await func(item)` for every item, in order.
+    # Up to `limit` calls run ahead of the consumer, so at most `limit` results are held at once.
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(asyncio.ensure_future(func(item)))
+            if len(pending) >= max(limit, 1):
+                yield await pending.popleft()
+
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def position_updates(wanted):
+    # wanted is a list of (id, current position or None if unknown, wanted position).
+    # Returns the payload for the bulk position endpoints, or None if everything is in place already.
+    if all(current == position for _, current, position in wanted):
+        return None
+
+    return [{"id": str(id), "position": position} for id, _, position in wanted]
+
+
+def role_position_updates(guild, ids):
+    # ids are the roles to order, lowest first. The other roles of the guild (managed and bot roles) keep their
+    # current position, the slots they occupy are skipped and they are part of the payload with those positions.
+    ids = list(ids)
+    ordered = set(ids)
+    kept = [role for role in guild.roles if not role.is_default() and role.id not in ordered]
+    taken = {role.position for role in kept}
+    free = (position for position in itertools.count(1) if position not in taken)
+    wanted = [(id, getattr(guild.get_role(id), "position", None), next(free)) for id in ids]
+    wanted.extend((role.id, role.position, role.position) for role in kept)
+    return position_updates(wanted)
+
+
+class TeardownStats:
+    def __init__(self):
+        self.removed = 0
+        # Entities that were already deleted
+        self.missing = 0
+        self.failed = 0
+        self.duration = 0
+
+    def __repr__(self):
+        return (f"<TeardownStats removed={self.removed} missing={self.missing} failed={self.failed} "
+                f"duration={self.duration:.2f}s>")
+
+
+async def teardown(entities, observer, reason=None, limit=1, semaphore=None):
+    # Deletes (entity, object) pairs concurrently and returns TeardownStats.
+    # Channel deletes have a rate limit bucket per channel and run up to `limit` at once. Role deletes
+    # share one bucket per guild, so they run one after another next to them instead of taking up slots.
+    stats = TeardownStats()
+
+    async def _delete(entity, obj):
+        try:
+            observer.api_call(entity, "delete")
+            await obj.delete(reason=reason)
+            stats.removed += 1
+        except discord.NotFound:
+            stats.missing += 1
+        except:
+            stats.failed += 1
+            observer.error(entity, sys.exc_info())
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        gather_limited([_delete(entity, obj) for entity, obj in entities if entity == "role"]),
+        gather_limited([_delete(entity, obj) for entity, obj in entities if entity != "role"],
+                       limit=limit, semaphore=semaphore),
+    )
+    stats.duration = time.perf_counter() - start
+    return stats
+
+
+async def create_channel(observer, entity, create, attributes, **fields):
+    # The attributes are sent with the create request, so a channel costs one call. Discord rejects the whole
+    # request if one of them isn't valid for the guild (e.g. a bitrate above its boost level), the channel
+    # is created without them then.
+    try:
+        observer.api_call(entity, "create")
+        return await create(**fields, **attributes)
+    except discord.HTTPException as e:
+        if e.status != 400:
+            raise
+
+        observer.retry(entity, "create", 1)
+        observer.api_call(entity, "create")
+        return await create(**fields)
+
+
+async def ban_pages(http, guild_id, observer=None, limit=BAN_PAGE_SIZE):
+    # Async generator yielding the ban list of a guild as pages of raw ban dicts ({"user": {...}, "reason": ...}),
+    # so only one page is held at a time. discord.py's get_bans has no paging, the route is requested directly.
+    # If the API ignores the paging parameters the whole list arrives as one page.
+    after = 0
+    while True:
+        if observer is not None:
+            observer.api_call("ban", "list")
+
+        page = await http.request(
+            Route("GET", "/guilds/{guild_id}/bans", guild_id=guild_id),
+            params={"limit": limit, "after": after}
+        )
+        page = [ban for ban in page if int(ban["user"]["id"]) > after]
+        if len(page) == 0:
+            return
+
+        yield page
+        if len(page) < limit:
+            return
+
+        after = max(int(ban["user"]["id"]) for ban in page)
+
+
+async def banned_ids(http, guild_id, observer=None):
+    ids = set()
+    async for page in ban_pages(http, guild_id, observer):
+        ids.update(int(ban["user"]["id"]) for ban in page)
+
+    return ids
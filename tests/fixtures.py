@@ -0,0 +1,66 @@
+import hashlib
+
+
+def make_backup(text_channels=3, voice_channels=1, categories=2, roles=3, messages=5, members=20, bans=10):
+    # A backup in the shape BackupSaver.save() returns. make_backup(0, 0, 0, 0, 0, 0, 0) is an empty guild
+    # that only has @everyone. The second message of every channel has archived attachments.
+    snowflake = iter(range(400000000000000000, 500000000000000000, 7919))
+    guild_id = str(next(snowflake))
+    role_list = [{
+        "id": guild_id, "default": True, "name": "@everyone", "permissions": 104324673, "color": 0,
+        "hoist": False, "position": 0, "mentionable": False
+    }] + [{
+        "id": str(next(snowflake)), "default": False, "name": f"role-{i}", "permissions": 8 * i, "color": 0xff00 + i,
+        "hoist": i % 2 == 0, "position": i, "mentionable": False
+    } for i in range(1, roles + 1)]
+    category_list = [{
+        "name": f"category-{i}", "position": i, "category": None, "id": str(next(snowflake)),
+        "overwrites": {guild_id: {"read_messages": False}, role_list[-1]["id"]: {"read_messages": True}}
+    } for i in range(categories)]
+    authors = [{
+        "id": str(next(snowflake)), "name": f"user{i}", "discriminator": f"{i:04d}",
+        "avatar_url": f"https://cdn.discordapp.com/avatars/{i}/abc.webp?size=1024"
+    } for i in range(3)]
+
+    def make_message(j):
+        message = {
+            "id": str(next(snowflake)), "content": f"message {j} with a 12345 number", "author": authors[j % 3],
+            "pinned": j == 0, "attachments": [], "embeds": [], "reactions": ["👍"] if j == 3 else []
+        }
+        if j == 1:
+            message["attachments"] = [f"https://cdn.discordapp.com/attachments/{j}/{name}"
+                                      for name in ("image.png", "notes.txt")]
+            message["archived"] = {url: hashlib.sha256(url.encode()).hexdigest() for url in message["attachments"]}
+
+        if j == 2:
+            message["embeds"] = [{"title": "embed", "fields": [{"name": "a", "value": "b"}]}]
+
+        return message
+
+    channels = [{
+        "name": f"text-{i}", "position": i, "id": str(next(snowflake)),
+        "category": category_list[i % categories]["id"] if i and categories else None,
+        "overwrites": {}, "topic": None if i else "topic", "slowmode_delay": 0, "nsfw": False,
+        "messages": [make_message(j) for j in range(messages)],
+        "webhooks": []
+    } for i in range(text_channels)]
+
+    return {
+        "id": guild_id, "name": "guild", "icon_url": "", "owner": authors[0]["id"], "member_count": members,
+        "region": "eu-central", "system_channel": "None", "afk_timeout": 300,
+        "afk_channel": None, "mfa_level": 0, "verification_level": "low", "explicit_content_filter": "disabled",
+        "large": members > 250,
+        "text_channels": channels,
+        "voice_channels": [{
+            "name": f"voice-{i}", "position": i, "id": str(next(snowflake)),
+            "category": category_list[0]["id"] if categories else None,
+            "overwrites": {}, "bitrate": 64000, "user_limit": 0
+        } for i in range(voice_channels)],
+        "categories": category_list,
+        "roles": role_list,
+        "members": [{
+            "id": str(next(snowflake)), "name": f"member{i}", "discriminator": "0001",
+            "nick": None if i % 3 else "nick", "roles": [role_list[1 + i % roles]["id"]] if roles else []
+        } for i in range(members)],
+        "bans": [{"user": str(next(snowflake)), "reason": "spam" if i % 2 else None} for i in range(bans)],
+    }
@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+import tempfile
+import unittest
+
+from discord_backups import AttachmentArchiver, DirectoryStore, MetricsRecorder
+
+
+class FakeContent:
+    def __init__(self, data):
+        self.data = data
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.data), size):
+            await asyncio.sleep(0)
+            yield self.data[start:start + size]
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.content = FakeContent(data)
+        self.content_length = None
+
+    def raise_for_status(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession:
+    # Urls end with the size of the file, the content is derived from the url
+    def get(self, url):
+        size = int(url.rsplit("/", 1)[1])
+        return FakeResponse(url.encode().ljust(size, b"."))
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = DirectoryStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def archive(self, archiver, urls):
+        async def run():
+            return await asyncio.gather(*[archiver.archive(url) for url in urls])
+
+        return asyncio.run(run())
+
+    def test_stores_content(self):
+        archiver = AttachmentArchiver(FakeSession(), self.store, observer=MetricsRecorder())
+        url = "https://cdn.discordapp.com/attachments/1/100"
+        key, = self.archive(archiver, [url])
+        data = asyncio.run(self.store.get(key))
+        self.assertEqual(key, hashlib.sha256(data).hexdigest())
+        self.assertEqual(len(data), 100)
+
+    def test_max_size(self):
+        archiver = AttachmentArchiver(FakeSession(), self.store, max_size=1000, observer=MetricsRecorder())
+        self.assertEqual(self.archive(archiver, ["https://cdn/a/2000"]), [None])
+        self.assertEqual(archiver.stats.too_large, 1)
+
+    def test_max_total_with_concurrent_downloads(self):
+        archiver = AttachmentArchiver(FakeSession(), self.store, concurrency=8, max_size=300000, max_total=1000000,
+                                      observer=MetricsRecorder())
+        keys = self.archive(archiver, [f"https://cdn/{i}/{200000 + i}" for i in range(12)])
+        self.assertLessEqual(archiver.stats.bytes, 1000000)
+        self.assertEqual(archiver.stats.downloaded, 4)
+        self.assertEqual(archiver.stats.over_total, 8)
+        self.assertEqual(sum(key is not None for key in keys), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
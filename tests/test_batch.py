@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+import unittest
+
+from discord_backups import BackupBatch, MetricsRecorder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fakes  # noqa: E402
+
+
+def make_guild(http):
+    return fakes.make_guild(http, text_channels=3, voice_channels=1, categories=1, roles=2, members=5,
+                            messages=2, bans=1)
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.http = fakes.FakeHTTP(latency=0, bucket_size=0)
+        self.bot = fakes.FakeBot(self.http)
+        self.recorder = MetricsRecorder()
+
+    def test_saves_queued_guilds(self):
+        batch = BackupBatch(self.bot, None, workers=2, observer=self.recorder)
+        guilds = [make_guild(self.http) for _ in range(3)]
+        for guild in guilds:
+            batch.add(guild)
+
+        results = asyncio.run(batch.run())
+        self.assertEqual(set(results), {guild.id for guild in guilds})
+        self.assertTrue(all(result.ok for result in results.values()))
+        self.assertEqual(len(results[guilds[0].id].data["text_channels"]), 3)
+
+    def test_entity_errors_fail_the_guild(self):
+        async def broken():
+            raise RuntimeError("no webhooks")
+
+        batch = BackupBatch(self.bot, None, observer=self.recorder)
+        guild, other = make_guild(self.http), make_guild(self.http)
+        for channel in guild.text_channels:
+            channel.webhooks = broken
+
+        batch.add(guild)
+        batch.add(other)
+        results = asyncio.run(batch.run())
+        self.assertFalse(results[guild.id].ok)
+        self.assertIsNone(results[guild.id].error)
+        self.assertEqual(results[guild.id].errors, 3)
+        self.assertTrue(results[other.id].ok)
+        self.assertEqual({error["guild"] for error in self.recorder.errors}, {str(guild.id)})
+
+    def test_late_additions(self):
+        batch = BackupBatch(self.bot, None, workers=2, observer=self.recorder)
+        batch.add(make_guild(self.http))
+        late = [make_guild(self.http) for _ in range(3)]
+
+        async def run():
+            saved = []
+            async for result in batch.stream(keep_open=True):
+                saved.append(result.guild.id)
+                if len(saved) == 1:
+                    for guild in late:
+                        batch.add(guild)
+
+                if len(saved) == 4:
+                    batch.close()
+
+            return saved
+
+        saved = asyncio.run(run())
+        self.assertEqual(set(saved[1:]), {guild.id for guild in late})
+
+    def test_closed_batch_rejects_additions(self):
+        batch = BackupBatch(self.bot, None, observer=self.recorder)
+        batch.add(make_guild(self.http))
+
+        async def run():
+            async for _ in batch.stream():
+                with self.assertRaises(RuntimeError):
+                    batch.add(make_guild(self.http))
+
+        asyncio.run(run())
+        # Not running anymore, guilds can be queued for the next run
+        batch.add(make_guild(self.http))
+        self.assertEqual(len(batch), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from discord_backups import FileStore
+
+
+class FileStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = FileStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_load_clear(self):
+        async def run():
+            self.assertIsNone(await self.store.load("job"))
+            await self.store.save("job", {"steps": ["roles"]})
+            self.assertEqual(await self.store.load("job"), {"steps": ["roles"]})
+            await self.store.clear("job")
+            self.assertIsNone(await self.store.load("job"))
+
+        asyncio.run(run())
+
+    def test_concurrent_saves_keep_the_newest_state(self):
+        async def run():
+            state = {"steps": []}
+            saves = []
+            for step in ("roles", "categories", "text_channels"):
+                state["steps"].append(step)
+                saves.append(asyncio.ensure_future(self.store.save("job", state)))
+
+            await asyncio.gather(*saves)
+            return await self.store.load("job")
+
+        self.assertEqual(asyncio.run(run()), {"steps": ["roles", "categories", "text_channels"]})
+        self.assertEqual(os.listdir(self.directory.name), ["job.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import copy
+import unittest
+
+from discord_backups import compact
+
+from .fixtures import make_backup
+
+
+class CompactTest(unittest.TestCase):
+    def test_round_trip(self):
+        data = make_backup(members=200, bans=50)
+        self.assertEqual(compact.decode(compact.encode(data)), data)
+
+    def test_empty_guild(self):
+        data = make_backup(0, 0, 0, 0, 0, 0, 0)
+        self.assertEqual(compact.decode(compact.encode(data)), data)
+
+    def test_empty_sections(self):
+        data = make_backup(text_channels=0, members=0, bans=0)
+        self.assertEqual(compact.decode(compact.encode(data)), data)
+
+    def test_archived_attachments(self):
+        data = make_backup()
+        message = compact.decode(compact.encode(data))["text_channels"][0]["messages"][1]
+        self.assertEqual(message["archived"], data["text_channels"][0]["messages"][1]["archived"])
+
+    def test_encode_doesnt_change_data(self):
+        data = make_backup()
+        expected = copy.deepcopy(data)
+        compact.encode(data)
+        self.assertEqual(data, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
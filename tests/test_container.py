@@ -0,0 +1,46 @@
+import io
+import unittest
+
+from discord_backups import container
+
+from .fixtures import make_backup
+
+
+class ContainerTest(unittest.TestCase):
+    def dump(self, data):
+        fp = io.BytesIO()
+        container.dump_container(fp, data)
+        fp.seek(0)
+        return container.BackupReader(fp)
+
+    def test_round_trip(self):
+        # More members and bans than fit into one chunk
+        data = make_backup(members=container.CHUNK_SIZE + 5, bans=container.CHUNK_SIZE + 3)
+        self.assertEqual(self.dump(data).load(), data)
+
+    def test_empty_guild(self):
+        data = make_backup(0, 0, 0, 0, 0, 0, 0)
+        reader = self.dump(data)
+        self.assertEqual(reader.load(), data)
+        self.assertEqual(len(reader.data["members"]), 0)
+
+    def test_archived_attachments(self):
+        data = make_backup()
+        message = self.dump(data).data["text_channels"][0]["messages"][1]
+        self.assertEqual(message["archived"], data["text_channels"][0]["messages"][1]["archived"])
+
+    def test_lazy_sections(self):
+        data = make_backup(members=container.CHUNK_SIZE + 5, bans=container.CHUNK_SIZE + 3)
+        reader = self.dump(data)
+        self.assertEqual(len(reader.data["members"]), len(data["members"]))
+        self.assertEqual(len(reader.data["bans"]), len(data["bans"]))
+        self.assertEqual(reader.data["members"][-1], data["members"][-1])
+        self.assertEqual(list(reader.data["text_channels"][1]["messages"]), data["text_channels"][1]["messages"])
+
+    def test_not_a_container(self):
+        with self.assertRaises(ValueError):
+            container.BackupReader(io.BytesIO(b"{}" * 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
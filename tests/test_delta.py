@@ -0,0 +1,66 @@
+import copy
+import unittest
+
+from discord_backups import delta
+
+from .fixtures import make_backup
+
+
+class DeltaTest(unittest.TestCase):
+    def changed(self, base):
+        new = copy.deepcopy(base)
+        new["name"] = "renamed"
+        new["roles"][1]["color"] = 0
+        new["roles"].reverse()
+        new["members"].pop(0)
+        new["bans"].append({"user": "1", "reason": None})
+        new["text_channels"][0]["topic"] = "new topic"
+        new["text_channels"][1]["messages"].append(dict(new["text_channels"][1]["messages"][0], id="2"))
+        new["text_channels"].append(dict(new["text_channels"][2], id="3", name="added"))
+        return new
+
+    def test_apply_diff(self):
+        base = make_backup()
+        new = self.changed(base)
+        self.assertEqual(delta.apply(base, delta.diff(base, new)), new)
+
+    def test_unchanged(self):
+        base = make_backup()
+        changes = delta.diff(base, copy.deepcopy(base))
+        self.assertEqual(changes["settings"], {})
+        self.assertEqual(changes["sections"], {})
+        self.assertEqual(changes["messages"], {})
+        self.assertEqual(delta.apply(base, changes), base)
+
+    def test_deleted_channel(self):
+        base = make_backup()
+        new = copy.deepcopy(base)
+        del new["text_channels"][1]
+        del new["voice_channels"][0]
+        del new["categories"][0]
+        self.assertEqual(delta.apply(base, delta.diff(base, new)), new)
+
+    def test_empty_guild(self):
+        empty = make_backup(0, 0, 0, 0, 0, 0, 0)
+        full = make_backup()
+        self.assertEqual(delta.apply(empty, delta.diff(empty, copy.deepcopy(empty))), empty)
+        self.assertEqual(delta.apply(empty, delta.diff(empty, full)), full)
+        self.assertEqual(delta.apply(full, delta.diff(full, empty)), empty)
+
+    def test_chained_deltas(self):
+        base = make_backup()
+        first = self.changed(base)
+        second = copy.deepcopy(first)
+        second["voice_channels"][0]["bitrate"] = 96000
+        second["text_channels"][0]["messages"].append(dict(second["text_channels"][0]["messages"][0], id="4"))
+        self.assertEqual(delta.apply(base, delta.diff(base, first), delta.diff(first, second)), second)
+
+    def test_chatlog_limit(self):
+        base = make_backup()
+        new = self.changed(base)
+        applied = delta.apply(base, delta.diff(base, new, chatlog=3))
+        self.assertEqual(applied["text_channels"][1]["messages"], new["text_channels"][1]["messages"][-3:])
+
+
+if __name__ == "__main__":
+    unittest.main()
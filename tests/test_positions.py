@@ -0,0 +1,69 @@
+import asyncio
+import os
+import sys
+import unittest
+
+from discord_backups import BackupLoader, BackupSaver, MetricsRecorder, copy_guild, utils
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fakes  # noqa: E402
+
+
+class RolePositionTest(unittest.TestCase):
+    def setUp(self):
+        self.http = fakes.FakeHTTP(latency=0, bucket_size=0)
+        self.bot = fakes.FakeBot(self.http)
+        self.origin = fakes.make_guild(self.http, text_channels=1, voice_channels=0, categories=0, roles=4,
+                                       members=5, messages=0, bans=0)
+        self.target = fakes.make_target(self.http)
+        # An integration role in the middle and the bot role at the top of the hierarchy
+        self.integration = self.managed_role("integration", 1)
+        self.bot_role = self.managed_role("bot", 2)
+
+    def managed_role(self, name, position):
+        role = fakes.FakeRole(self.target, self.http.snowflake(), name, position, managed=True)
+        self.target._roles[role.id] = role
+        return role
+
+    def assertHierarchy(self, roles):
+        positions = [role.position for role in self.target.roles]
+        self.assertEqual(len(positions), len(set(positions)))
+        names = [role.name for role in self.target.roles if not role.managed and not role.is_default()]
+        self.assertEqual(names, [role["name"] for role in roles])
+
+    def test_payload_skips_managed_slots(self):
+        # Two restored roles in the wrong order around the integration role
+        self.integration.position, self.bot_role.position = 2, 4
+        upper = fakes.FakeRole(self.target, self.http.snowflake(), "upper", 1)
+        lower = fakes.FakeRole(self.target, self.http.snowflake(), "lower", 3)
+        self.target._roles[upper.id] = upper
+        self.target._roles[lower.id] = lower
+        positions = utils.role_position_updates(self.target, [lower.id, upper.id])
+        self.assertEqual({int(entry["id"]): entry["position"] for entry in positions}, {
+            lower.id: 1, self.integration.id: 2, upper.id: 3, self.bot_role.id: 4
+        })
+
+    def test_payload_in_place(self):
+        self.assertIsNone(utils.role_position_updates(self.target, []))
+
+    def test_load_keeps_managed_roles(self):
+        data = asyncio.run(BackupSaver(self.bot, None, self.origin).save(chatlog=0))
+        # Needs the bulk call, the creation order doesn't give this hierarchy
+        first, _, third = data["roles"][1:4]
+        first["position"], third["position"] = third["position"], first["position"]
+        loader = BackupLoader(self.bot, None, data, MetricsRecorder())
+        asyncio.run(loader.load(self.target, "test", 0, roles=True))
+        self.assertEqual(loader.observer.calls[("role", "positions")], 1)
+        # New roles are created below the managed roles, which stay where the creates moved them
+        self.assertEqual([self.integration.position, self.bot_role.position], [5, 6])
+        self.assertHierarchy(sorted(data["roles"][1:], key=lambda role: role["position"]))
+
+    def test_copy_keeps_managed_roles(self):
+        asyncio.run(copy_guild(self.origin, self.target, 0, observer=MetricsRecorder()))
+        self.assertEqual([self.integration.position, self.bot_role.position], [5, 6])
+        self.assertHierarchy([{"name": role.name} for role in self.origin.roles[1:]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import sys
+import unittest
+
+import discord
+
+from discord_backups import BackupReconciler, BackupSaver, MetricsRecorder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fakes  # noqa: E402
+
+OPTIONS = dict(roles=True, channels=True)
+
+
+class ReconcileTest(unittest.TestCase):
+    def setUp(self):
+        self.http = fakes.FakeHTTP(latency=0, bucket_size=0)
+        self.bot = fakes.FakeBot(self.http)
+        self.guild = fakes.make_guild(self.http, text_channels=4, voice_channels=1, categories=2, roles=3,
+                                      members=5, messages=0, bans=0)
+        self.data = asyncio.run(BackupSaver(self.bot, None, self.guild).save(chatlog=0))
+
+    def reconcile(self):
+        reconciler = BackupReconciler(self.bot, None, self.data, MetricsRecorder())
+        asyncio.run(reconciler.load(self.guild, "test", 0, **OPTIONS))
+        return reconciler
+
+    def plan(self):
+        reconciler = BackupReconciler(self.bot, None, self.data)
+        reconciler.guild = self.guild
+        reconciler.options = OPTIONS
+        return reconciler.make_plan()
+
+    def test_unchanged_guild(self):
+        self.assertEqual(len(self.plan()), 0)
+
+    def test_changed_overwrite_is_sent(self):
+        category = self.guild.categories[0]
+        category.overwrites = {self.guild.default_role: discord.PermissionOverwrite(read_messages=True)}
+        self.assertEqual([(a.kind, a.changes) for a in self.plan()], [("edit", ("overwrites",))])
+
+        self.reconcile()
+        self.assertEqual(category.overwrites[self.guild.default_role]._values, {"read_messages": False})
+        self.assertEqual(len(self.plan()), 0)
+
+    def test_overwrite_of_missing_member(self):
+        # Members that left the guild are skipped like the loader does, they don't cause an edit on every plan
+        self.data["categories"][0]["overwrites"]["1234"] = {"send_messages": False}
+        self.assertEqual(len(self.plan()), 0)
+
+    def test_overwrite_of_role_to_create(self):
+        role = self.data["roles"][-1]
+        self.guild._roles.pop(int(role["id"]))
+        self.data["categories"][0]["overwrites"][role["id"]] = {"send_messages": False}
+        self.assertIn(("edit", "category"), {(action.kind, action.entity) for action in self.plan()})
+
+
+if __name__ == "__main__":
+    unittest.main()
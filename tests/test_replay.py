@@ -0,0 +1,49 @@
+import unittest
+
+from discord_backups.replay import MAX_CONTENT, MAX_EMBEDS, coalesce
+
+
+def message(author="1", content="hello", attachments=(), embeds=0):
+    return {
+        "id": "10", "content": content, "pinned": False, "reactions": [],
+        "author": {"id": author, "name": f"user{author}", "discriminator": "0001", "avatar_url": ""},
+        "attachments": list(attachments),
+        "embeds": [{"title": f"embed {i}"} for i in range(embeds)],
+    }
+
+
+class CoalesceTest(unittest.TestCase):
+    def test_merges_same_author(self):
+        posts = list(coalesce([message(content="a"), message(content="b"), message("2", "c"), message(content="d")]))
+        self.assertEqual([(post["content"], merged) for post, merged in posts], [("a\nb", 2), ("c", 1), ("d", 1)])
+
+    def test_attachments(self):
+        # Images are shown as embeds, other files are linked in the content
+        post, _ = next(coalesce([message(attachments=[
+            "https://cdn.discordapp.com/attachments/1/image.PNG",
+            "https://cdn.discordapp.com/attachments/1/video.mp4",
+            "https://cdn.discordapp.com/attachments/1/notes.txt?size=1",
+        ])]))
+        self.assertEqual(post["content"], "hello\nhttps://cdn.discordapp.com/attachments/1/video.mp4\n"
+                                          "https://cdn.discordapp.com/attachments/1/notes.txt?size=1")
+        self.assertEqual([embed.image.url for embed in post["embeds"]],
+                         ["https://cdn.discordapp.com/attachments/1/image.PNG"])
+
+    def test_file_only_message(self):
+        post, _ = next(coalesce([message(content="", attachments=["https://cdn.discordapp.com/a/file.zip"])]))
+        self.assertEqual(post["content"], "https://cdn.discordapp.com/a/file.zip")
+
+    def test_embed_limit_starts_new_post(self):
+        posts = list(coalesce([message(embeds=6), message(embeds=6)]))
+        self.assertEqual([(len(post["embeds"]), merged) for post, merged in posts], [(6, 1), (6, 1)])
+
+    def test_large_message_is_split(self):
+        posts = list(coalesce([message(content="x" * (MAX_CONTENT + 5), embeds=MAX_EMBEDS * 2 + 3),
+                               message(content="after")]))
+        self.assertEqual([(len(post["content"]), len(post["embeds"]), merged) for post, merged in posts],
+                         [(MAX_CONTENT, MAX_EMBEDS, 1), (5, MAX_EMBEDS, 0), (len("after"), 3, 1)])
+        self.assertEqual(sum(merged for _, merged in posts), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()